@@ -1,10 +1,11 @@
 # app.py
 
-from flask import Flask, request, jsonify, g, send_from_directory
+from flask import Flask, request, jsonify, g, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 import pyodbc
 import os
 import json
+import itertools
 from datetime import datetime
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -13,6 +14,18 @@ from dotenv import load_dotenv
 from datetime import timedelta
 from gevent import pywsgi
 import logging
+import click
+import archive
+import migrations
+import bulk
+import json_provider
+import compression
+import columnar
+import history
+import rollup
+import prefix_index
+import deadline
+import user_cache
 # ===============================================
 # Flask 和 JWT 配置
 # ===============================================
@@ -29,7 +42,7 @@ def handle_preflight():
                 res = app.make_response("")
                 res.headers['Access-Control-Allow-Origin'] = "*"
                 res.headers['Access-Control-Allow-Methods'] = "GET, POST, PUT, DELETE, OPTIONS"
-                res.headers['Access-Control-Allow-Headers'] = "Content-Type, Authorization"
+                res.headers['Access-Control-Allow-Headers'] = "Content-Type, Authorization, X-Request-Timeout"
                 return res, 200
 
 # 從環境變數設定 JWT 密鑰
@@ -37,8 +50,27 @@ app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
 app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(minutes=60)
 app.config['UPLOAD_FOLDER'] = 'static/uploads' 
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024 # 16 MB
+# CC_LOG 歸檔設定：超過 LOG_ARCHIVE_DAYS 天的日誌會搬到 LOG_ARCHIVE_DIR
+app.config['LOG_ARCHIVE_DIR'] = os.getenv("LOG_ARCHIVE_DIR", "archive/cc_log")
+app.config['LOG_ARCHIVE_DAYS'] = int(os.getenv("LOG_ARCHIVE_DAYS", "365"))
+# 請求截止時間 (秒，個別路由見 deadline.ROUTE_TIMEOUTS) 與單一查詢的逾時上限
+app.config['REQUEST_TIMEOUT'] = int(os.getenv("REQUEST_TIMEOUT", str(deadline.DEFAULT_TIMEOUT)))
+app.config['DB_STATEMENT_TIMEOUT'] = int(os.getenv("DB_STATEMENT_TIMEOUT", "30"))
+# 搜尋用前綴索引重新載入的間隔 (秒)，多個 worker 時其他 worker 的寫入最晚在此時間後可見
+app.config['SEARCH_INDEX_TTL'] = int(os.getenv("SEARCH_INDEX_TTL", "60"))
+# 帳號快取同步新帳號的間隔 (秒)，其他 worker 註冊的帳號最晚在此時間後可見
+app.config['USER_CACHE_TTL'] = int(os.getenv("USER_CACHE_TTL", str(user_cache.DEFAULT_TTL)))
+# 統計彙總背景更新間隔 (秒)，0 表示停用，改用 flask rollup-refresh 排程
+app.config['ROLLUP_INTERVAL'] = int(os.getenv("ROLLUP_INTERVAL", "300"))
+
+# JSON 編碼器 (orjson / default) 與回應壓縮設定
+app.config['JSON_PROVIDER'] = os.getenv("JSON_PROVIDER", "orjson")
+app.config['COMPRESS_MIN_SIZE'] = int(os.getenv("COMPRESS_MIN_SIZE", "1024"))
+app.config['COMPRESS_CACHE_BYTES'] = int(os.getenv("COMPRESS_CACHE_BYTES", str(32 * 1024 * 1024)))
 
 jwt = JWTManager(app)
+json_provider.install(app, app.config['JSON_PROVIDER'])
+compression.init_app(app)
 
 # ===============================================
 # 應用程式配置
@@ -86,6 +118,10 @@ def get_db_connection():
         if "db" not in g:
                 try:
                         g.db = pyodbc.connect(conn_str)
+                        request_deadline = g.get("request_deadline")
+                        if request_deadline is not None:
+                                # 之後建立的 cursor 都會套用剩餘時間作為查詢逾時
+                                g.db = deadline.DeadlineConnection(g.db, request_deadline, app.config['DB_STATEMENT_TIMEOUT'])
                         logging.debug("成功建立資料庫連線")
                 except pyodbc.Error as ex:
                         sqlstate = ex.args[0]
@@ -100,6 +136,37 @@ def close_db_connection(exception=None):
                 db.close()
                 print("✅ 資料庫連線已關閉")
 
+search_index = prefix_index.PrefixIndex(ttl=app.config['SEARCH_INDEX_TTL'])
+
+def ensure_search_index():
+        # 第一次在目前的執行緒載入，之後超過 TTL 時在背景重新載入
+        search_index.refresh(lambda: pyodbc.connect(conn_str))
+
+# 帳號是否存在的快取 (Bloom filter + 已確認的 LRU)，供登入畫面的帳號檢查使用
+user_directory = user_cache.UserDirectory(ttl=app.config['USER_CACHE_TTL'])
+
+@app.before_request
+def start_request_deadline():
+        requested = request.headers.get("X-Request-Timeout", type=float)
+        seconds = deadline.timeout_for(request.endpoint, app.config['REQUEST_TIMEOUT'], requested)
+        g.request_deadline = deadline.RequestDeadline(seconds, deadline.client_socket(request.environ))
+        deadline.watchdog.register(g.request_deadline)
+
+@app.after_request
+def convert_deadline_error(response):
+        # 查詢因逾時被取消時，路由會回傳 500；改成 504 讓客戶端知道是逾時
+        request_deadline = g.get("request_deadline")
+        if request_deadline is not None and request_deadline.expired and response.status_code == 500:
+                response = jsonify({"success": False, "error": "查詢逾時，請稍後再試"})
+                response.status_code = 504
+        return response
+
+@app.teardown_request
+def end_request_deadline(exception=None):
+        request_deadline = g.pop("request_deadline", None)
+        if request_deadline is not None:
+                deadline.watchdog.unregister(request_deadline)
+
 def row_to_dict(row):
         return {column[0]: row[i] for i, column in enumerate(row.cursor_description)}
 
@@ -151,11 +218,7 @@ def verify_username():
                 if not username:
                         return jsonify({"success": False, "error": "請提供使用者名稱"}), 400
 
-                cursor = conn.cursor()
-                cursor.execute(
-                        "SELECT COUNT(*) FROM CC_USER WHERE USER_NAME = ?", (username,)
-                )
-                if cursor.fetchone()[0] > 0:
+                if user_directory.exists(conn, username):
                         return jsonify({"success": True, "message": "使用者名稱存在"}), 200
                 else:
                         return jsonify({"success": False, "error": "使用者不存在"}), 404
@@ -178,25 +241,32 @@ def register():
                 if not username or not password:
                         return jsonify({"success": False, "error": "請提供使用者名稱和密碼"}), 400
 
-                # 檢查帳號是否已存在
-                cursor = conn.cursor()
-                cursor.execute("SELECT USER_NAME FROM [CC_USER] WHERE USER_NAME = ?", (username,))
-                existing_user = cursor.fetchone()
-                if existing_user:
+                # 檢查帳號是否已存在；舊資料庫的 USER_NAME 不一定有唯一鍵，
+                # 快取判定不存在 (可能尚未同步其他 worker 的註冊) 時仍向資料庫確認
+                if user_directory.exists(conn, username, confirm_absent=True):
                         return jsonify({"success": False, "error": "使用者名稱已存在"}), 409
 
                 # 雜湊密碼
                 hashed_password = generate_password_hash(password)
 
                 # 插入新使用者
+                cursor = conn.cursor()
                 cursor.execute(
                         "INSERT INTO [CC_USER] (USER_NAME, PASSWORD) VALUES (?, ?)",
                         (username, hashed_password)
                 )
                 conn.commit()
+                user_directory.mark_exists(username)
+                search_index.add_user(username)
 
                 return jsonify({"success": True, "message": "帳號註冊成功"}), 201
 
+        except pyodbc.IntegrityError as e:
+                # 其他 worker 剛註冊了同名帳號 (本 worker 的快取尚未同步)
+                conn.rollback()
+                user_directory.mark_exists(username)
+                print(f"❌ 註冊錯誤 (IntegrityError): {e}")
+                return jsonify({"success": False, "error": "使用者名稱已存在"}), 409
         except Exception as e:
                 conn.rollback()
                 print(f"註冊錯誤: {e}")
@@ -218,20 +288,25 @@ def reset_password_no_auth():
                 if not username or not new_password:
                         return jsonify({"success": False, "error": "請提供使用者名稱和新密碼"}), 400
 
-                cursor = conn.cursor()
-                cursor.execute(
-                        "SELECT COUNT(*) FROM CC_USER WHERE USER_NAME = ?", (username,)
-                )
-                if cursor.fetchone()[0] == 0:
+                # 先確認帳號存在，不存在時不必計算密碼雜湊；快取的「不存在」可能尚未同步，
+                # 拒絕前再向資料庫確認
+                if not user_directory.exists(conn, username, confirm_absent=True):
                         return jsonify({"success": False, "error": "使用者不存在"}), 404
 
                 hashed_password = generate_password_hash(new_password)
+                cursor = conn.cursor()
                 cursor.execute(
                         "UPDATE [CC_USER] SET PASSWORD = ? WHERE USER_NAME = ?",
                 (hashed_password, username)
                 )
+                updated = cursor.rowcount
                 conn.commit()
 
+                if updated == 0:
+                        user_directory.invalidate(username)
+                        return jsonify({"success": False, "error": "使用者不存在"}), 404
+                user_directory.mark_exists(username)
+
                 return jsonify({
                         "success": True,
                         "message": f"使用者 {username} 的密碼已成功重設。",
@@ -257,13 +332,8 @@ def forgot_password():
                 if not username:
                         return jsonify({"success": False, "error": "請提供使用者名稱"}), 400
 
-                cursor = conn.cursor()
-                cursor.execute(
-                        "SELECT COUNT(*) FROM CC_USER WHERE USER_NAME = ?", (username,)
-                )
-                user_exists = cursor.fetchone()[0]
-
-                if user_exists == 0:
+                # 沒有副作用，與 verify_username 相同直接使用快取 (其他 worker 的註冊最晚 TTL 秒後可見)
+                if not user_directory.exists(conn, username):
                         return jsonify({"success": False, "error": "使用者不存在"}), 404
 
                 # 這裡由於沒有郵件服務，我們只回傳成功訊息
@@ -301,10 +371,13 @@ def reset_password():
                         "UPDATE [CC_USER] SET PASSWORD = ? WHERE USER_NAME = ?",
                         (hashed_password, target_username)
                 )
+                updated = cursor.rowcount
                 conn.commit()
 
-                if cursor.rowcount == 0:
+                if updated == 0:
+                        user_directory.invalidate(target_username)
                         return jsonify({"success": False, "error": "未找到該使用者"}), 404
+                user_directory.mark_exists(target_username)
 
                 return jsonify({
                         "success": True,
@@ -321,13 +394,17 @@ def reset_password():
 # ===============================================
 # 器材管理 API
 # ===============================================
-# 獲取所有器材
+# 獲取所有器材 (?format=columnar / msgpack 可取得精簡格式)
 @app.route("/api/equipment", methods=["GET"])
 @jwt_required()
 def get_equipment_data():
         conn = get_db_connection()
         if conn is None:
                 return jsonify({"success": False, "error": "資料庫連線失敗"}), 500
+        try:
+                fmt = columnar.requested_format(request)
+        except columnar.UnsupportedFormatError as e:
+                return jsonify({"success": False, "error": str(e)}), 406
         try:
                 cursor = conn.cursor()
                 
@@ -364,6 +441,16 @@ def get_equipment_data():
                         ORDER BY
                                 M.CCM_ID
                 """)
+                # UPD_CNT 只計算資料庫中的日誌，需補上已歸檔的筆數
+                archived = archive.archived_counts(app.config['LOG_ARCHIVE_DIR'])
+
+                if fmt:
+                        columns, data = columnar.build_columns(cursor)
+                        ids = data[columns.index('CCM_ID')]
+                        position = columns.index('UPD_CNT')
+                        data[position] = [(cnt or 0) + archived.get(ccm_id, 0) for ccm_id, cnt in zip(ids, data[position])]
+                        return columnar.make_response(app, fmt, columns, data), 200
+
                 columns = [column[0] for column in cursor.description]
                 equipment_list = [dict(zip(columns, row)) for row in cursor.fetchall()]
 
@@ -375,6 +462,7 @@ def get_equipment_data():
                                 item['狀態更新時間'] = item['狀態更新時間'].strftime('%Y-%m-%d %H:%M:%S')
                         if item.get('UPD_CNT') is None:
                                 item['UPD_CNT'] = 0
+                        item['UPD_CNT'] += archived.get(item['CCM_ID'], 0)
                 return jsonify(equipment_list), 200
         except Exception as e:
                 print(f"❌ 獲取器材資料錯誤: {e}")
@@ -444,6 +532,7 @@ def add_equipment():
                 )
 
                 conn.commit()
+                search_index.put_item(ccm_id, box_id, user_name)
                 print(f"✅ 新增器材 {ccm_id} 成功。")
                 return jsonify({"success": True, "message": f"器材 {ccm_id} 新增成功"}), 201
         
@@ -520,6 +609,7 @@ def update_equipment(ccm_id):
                 )
 
                 conn.commit()
+                search_index.put_item(ccm_id, box_id, user_name)
                 
                 return jsonify({"success": True, "message": "器材更新成功"}), 200
         except Exception as e:
@@ -591,6 +681,59 @@ def batch_update_equipment():
                 print(f"❌ 批次更新錯誤: {e}")
                 return jsonify({"success": False, "error": f"伺服器錯誤: {e}"}), 500
 
+# 批次匯入器材 (CSV / XLSX)
+@app.route("/api/equipment/import", methods=["POST"])
+@jwt_required()
+def import_equipment():
+        """
+        上傳 CSV 或 XLSX 檔案 (欄位名稱同新增器材)，CC_MASTER 以 CCM_ID 新增或更新，
+        有 CC_STATUS 的列會另外寫入一筆 CC_LOG。回傳每一列的錯誤報告。
+        """
+        conn = get_db_connection()
+        if conn is None:
+                return jsonify({"success": False, "error": "資料庫連線失敗"}), 500
+
+        file = request.files.get("file")
+        if not file or not file.filename:
+                return jsonify({"success": False, "error": "請上傳 CSV 或 XLSX 檔案"}), 400
+        try:
+                current_user = get_jwt_identity()
+                result = bulk.import_equipment(conn, file.stream, file.filename, current_user)
+                if result["imported"]:
+                        # 大量寫入後直接重建索引，比逐筆更新簡單
+                        search_index.load(conn.cursor())
+                print(f"✅ 批次匯入完成：{result['imported']}/{result['total']} 筆")
+                return jsonify({"success": not result["errors"], **result}), 200
+        except bulk.ImportFormatError as e:
+                return jsonify({"success": False, "error": str(e)}), 400
+        except Exception as e:
+                conn.rollback()
+                print(f"❌ 批次匯入錯誤: {e}")
+                return jsonify({"success": False, "error": "伺服器錯誤"}), 500
+
+# 串流匯出 CSV (type=equipment 為器材與目前狀態，type=logs 為完整日誌歷史)
+@app.route("/api/equipment/export", methods=["GET"])
+@jwt_required()
+def export_equipment():
+        conn = get_db_connection()
+        if conn is None:
+                return jsonify({"success": False, "error": "資料庫連線失敗"}), 500
+
+        export_type = request.args.get("type", "equipment")
+        if export_type == "equipment":
+                chunks = bulk.export_equipment_csv(conn)
+        elif export_type == "logs":
+                chunks = bulk.export_logs_csv(conn, app.config['LOG_ARCHIVE_DIR'])
+        else:
+                return jsonify({"success": False, "error": "type 只能是 equipment 或 logs"}), 400
+
+        filename = f"{export_type}_{datetime.now().strftime('%Y%m%d%H%M%S')}.csv"
+        return Response(
+                stream_with_context(chunks),
+                mimetype="text/csv",
+                headers={"Content-Disposition": f"attachment; filename={filename}"}
+        )
+
 # 刪除器材
 @app.route("/api/equipment/<string:ccm_id>", methods=["DELETE"])
 @jwt_required()
@@ -602,9 +745,13 @@ def delete_equipment(ccm_id):
         try:
                 cursor = conn.cursor()
                 cursor.execute("DELETE FROM CC_MASTER WHERE CCM_ID = ?", ccm_id)
+                deleted = cursor.rowcount
+                if deleted:
+                        rollup.forget_item(cursor, ccm_id)
                 conn.commit()
-                if cursor.rowcount == 0:
+                if deleted == 0:
                         return jsonify({"success": False, "error": "未找到該器材"}), 404
+                search_index.remove_item(ccm_id)
                 return jsonify({"success": True, "message": "器材刪除成功"}), 200
         except Exception as e:
                 conn.rollback()
@@ -641,6 +788,7 @@ def get_status_counts():
                 pass
 
 # 獲取器材日誌歷史
+# 可選參數 limit / offset 做分頁；資料庫與歸檔的日誌會合併後依 UPDATE_TIME 由新到舊排序
 @app.route("/api/equipment/logs/<string:ccm_id>", methods=["GET"])
 @jwt_required()
 def get_log_history(ccm_id):
@@ -648,15 +796,45 @@ def get_log_history(ccm_id):
         if conn is None:
                 return jsonify({"success": False, "error": "資料庫連線失敗"}), 500
         try:
+                limit = request.args.get("limit", type=int)
+                offset = request.args.get("offset", default=0, type=int)
+                if (limit is not None and limit <= 0) or offset < 0:
+                        return jsonify({"success": False, "error": "limit 或 offset 參數不正確"}), 400
+
                 cursor = conn.cursor()
                 # 你的歷史紀錄表格是 CC_LOG
-                cursor.execute("SELECT * FROM CC_LOG WHERE CC_ID_FK = ? ORDER BY UPDATE_TIME DESC", ccm_id)
+                if limit is None:
+                        cursor.execute("SELECT * FROM CC_LOG WHERE CC_ID_FK = ? ORDER BY UPDATE_TIME DESC, CCL_ID DESC", ccm_id)
+                else:
+                        # 只需要取前 offset + limit 筆，與歸檔合併後再切出該頁
+                        cursor.execute(
+                                """
+                                SELECT * FROM CC_LOG WHERE CC_ID_FK = ?
+                                ORDER BY UPDATE_TIME DESC, CCL_ID DESC
+                                OFFSET 0 ROWS FETCH NEXT ? ROWS ONLY
+                                """,
+                                ccm_id, offset + limit
+                        )
                 columns = [column[0] for column in cursor.description]
-                history_list = [dict(zip(columns, row)) for row in cursor.fetchall()]
+                hot_list = [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+                archive_dir = app.config['LOG_ARCHIVE_DIR']
+                # 歸檔的日誌都比資料庫中的舊 (archive_logs 由最舊的開始搬)，
+                # 資料庫已足夠填滿這一頁時不必解壓歸檔；UPDATE_TIME 為 NULL 的排在歸檔之後，仍需合併
+                if limit is None or len(hot_list) < offset + limit or hot_list[-1].get("UPDATE_TIME") is None:
+                        archived_list = archive.read_archived_logs(archive_dir, ccm_id)
+                else:
+                        archived_list = []
+                history_list = archive.merge_history(hot_list, archived_list, offset, limit)
                 response_data = {
                         "success": True,
                         "data": history_list
                 }
+                if limit is not None:
+                        cursor.execute("SELECT COUNT(*) FROM CC_LOG WHERE CC_ID_FK = ?", ccm_id)
+                        response_data["total"] = cursor.fetchone()[0] + archive.archived_count(archive_dir, ccm_id)
+                        response_data["limit"] = limit
+                        response_data["offset"] = offset
                 return jsonify(response_data), 200
         except Exception as e:
                 print(f"❌ 獲取日誌歷史錯誤: {e}")
@@ -664,6 +842,95 @@ def get_log_history(ccm_id):
         finally:
                 pass
 
+# 前綴搜尋 (自動完成)：?q=前綴&field=ccm_id|box_id|user_name (預設全部)&limit=20
+@app.route("/api/search", methods=["GET"])
+@jwt_required()
+def search_prefix():
+        prefix = request.args.get("q", "").strip()
+        if not prefix:
+                return jsonify({"success": False, "error": "請提供搜尋字串 q"}), 400
+        field = request.args.get("field")
+        if field:
+                fields = (field.upper(),)
+                if fields[0] not in prefix_index.FIELDS:
+                        return jsonify({"success": False, "error": "field 只能是 ccm_id、box_id 或 user_name"}), 400
+        else:
+                fields = prefix_index.FIELDS
+        limit = min(max(request.args.get("limit", default=20, type=int), 1), 200)
+
+        if search_index.is_stale():
+                try:
+                        ensure_search_index()
+                except Exception as e:
+                        print(f"❌ 載入搜尋索引錯誤: {e}")
+                        return jsonify({"success": False, "error": "伺服器錯誤"}), 500
+
+        return jsonify({"success": True, "data": search_index.search(prefix, fields, limit)}), 200
+
+# 一次取得多個器材的日誌歷史
+# GET ?ids=A,B&limit=K 或 ?box_id=X；POST {"ccm_ids": [...], "box_id": "...", "limit": K}
+# 回傳 {"success": true, "data": {CCM_ID: [日誌...]}}，結果很大時改為串流輸出
+@app.route("/api/equipment/logs", methods=["GET", "POST"])
+@jwt_required()
+def get_batch_log_history():
+        conn = get_db_connection()
+        if conn is None:
+                return jsonify({"success": False, "error": "資料庫連線失敗"}), 500
+
+        if request.method == "POST":
+                data = request.get_json(silent=True) or {}
+                ccm_ids = data.get("ccm_ids") or []
+                box_id = data.get("box_id")
+                limit = data.get("limit")
+        else:
+                ccm_ids = [i for i in request.args.get("ids", "").split(",") if i.strip()]
+                box_id = request.args.get("box_id")
+                limit = request.args.get("limit", type=int)
+
+        if not isinstance(ccm_ids, list) or not all(isinstance(i, str) for i in ccm_ids):
+                return jsonify({"success": False, "error": "ccm_ids 應為字串列表"}), 400
+        if limit is not None and (not isinstance(limit, int) or limit <= 0):
+                return jsonify({"success": False, "error": "limit 參數不正確"}), 400
+
+        try:
+                cursor = conn.cursor()
+                if box_id:
+                        ccm_ids = ccm_ids + history.box_item_ids(cursor, box_id)
+                ccm_ids = list(dict.fromkeys(i.strip() for i in ccm_ids))
+                if not ccm_ids:
+                        return jsonify({"success": False, "error": "請提供 ccm_ids 或 box_id"}), 400
+                if len(ccm_ids) > history.MAX_IDS:
+                        return jsonify({"success": False, "error": f"一次最多查詢 {history.MAX_IDS} 個器材"}), 400
+
+                groups = history.iter_grouped_logs(cursor, ccm_ids, limit, app.config['LOG_ARCHIVE_DIR'])
+
+                # 先把結果讀進記憶體；超過門檻時改成串流，已讀取的部分先輸出
+                buffered = {}
+                row_count = 0
+                for ccm_id, rows in groups:
+                        buffered[ccm_id] = rows
+                        row_count += len(rows)
+                        if row_count > history.STREAM_THRESHOLD:
+                                break
+                else:
+                        return jsonify({"success": True, "data": buffered}), 200
+
+                def generate():
+                        yield '{"success":true,"data":{'
+                        first = True
+                        for ccm_id, rows in itertools.chain(buffered.items(), groups):
+                                prefix = "" if first else ","
+                                first = False
+                                yield f"{prefix}{app.json.dumps(ccm_id)}:{app.json.dumps(rows)}"
+                        yield "}}"
+
+                # 串流開始後不再套用截止時間，避免 watchdog 在輸出途中取消查詢而截斷 200 回應
+                g.request_deadline.disarm()
+                return Response(stream_with_context(generate()), mimetype="application/json")
+        except Exception as e:
+                print(f"❌ 批次獲取日誌歷史錯誤: {e}")
+                return jsonify({"success": False, "error": "伺服器錯誤"}), 500
+
 # ===============================================
 # 問題回報 API
 # ===============================================
@@ -726,6 +993,10 @@ def get_all_reports():
         conn = get_db_connection()
         if conn is None:
                 return jsonify({"success": False, "error": "資料庫連線失敗"}), 500
+        try:
+                fmt = columnar.requested_format(request)
+        except columnar.UnsupportedFormatError as e:
+                return jsonify({"success": False, "error": str(e)}), 406
 
         try:
                 cursor = conn.cursor()
@@ -733,7 +1004,14 @@ def get_all_reports():
                 cursor.execute(
                         "SELECT ID, CCM_ID_FK, REPORTER, REPORT_TIME, ISSUE_TYPE, ISSUE_INFO, IMAGE_PATH, STATUS, PROCESSER, PROCESS_TIME, PROCESS_NOTES FROM CC_REPORT ORDER BY REPORT_TIME DESC"
                 )
-                
+
+                if fmt:
+                        format_time = lambda value: value.strftime("%Y-%m-%d %H:%M:%S") if value else None
+                        columns, data = columnar.build_columns(
+                                cursor, {"REPORT_TIME": format_time, "PROCESS_TIME": format_time}
+                        )
+                        return columnar.make_response(app, fmt, columns, data), 200
+
                 rows = cursor.fetchall()
                 
                 reports = []
@@ -778,15 +1056,20 @@ def update_report(report_id):
                         return jsonify({"success": False, "error": "處理狀態為必填項"}), 400
 
                 cursor = conn.cursor()
+                old_state = rollup.report_state(cursor, report_id)
                 sql = """
                         UPDATE CC_REPORT SET
                         STATUS = ?, PROCESSER = ?, PROCESS_NOTES = ?, PROCESS_TIME = GETDATE()
                         WHERE ID = ?
                 """
                 cursor.execute(sql, status, current_user, process_notes, report_id)
+                updated = cursor.rowcount
+                if updated:
+                        # 與更新同一個交易，維護回報處理時間彙總
+                        rollup.apply_report_change(cursor, old_state, rollup.report_state(cursor, report_id))
                 conn.commit()
 
-                if cursor.rowcount == 0:
+                if updated == 0:
                         return jsonify({"success": False, "error": "未找到該回報或沒有資料更新"}), 404
                         
                 return jsonify({"success": True, "message": "回報資料更新成功"}), 200
@@ -817,10 +1100,14 @@ def delete_report(report_id):
                                 os.remove(file_to_delete)
                                 print(f"✅ 已刪除圖片文件: {file_to_delete}")
 
+                old_state = rollup.report_state(cursor, report_id)
                 cursor.execute("DELETE FROM CC_REPORT WHERE ID = ?", (report_id,))
+                deleted = cursor.rowcount
+                if deleted:
+                        rollup.apply_report_change(cursor, old_state, None)
                 conn.commit()
 
-                if cursor.rowcount == 0:
+                if deleted == 0:
                         return jsonify({"success": False, "error": "未找到該回報或沒有資料刪除"}), 404
                         
                 return jsonify({"success": True, "message": "回報已成功刪除"}), 200
@@ -832,6 +1119,70 @@ def delete_report(report_id):
         finally:
                 pass
 
+# ===============================================
+# 統計分析 API (讀取彙總表，需先執行 db-migrate)
+# ===============================================
+# 每天各狀態的器材數，?from=YYYY-MM-DD&to=YYYY-MM-DD，預設最近 30 天
+@app.route("/api/analytics/status_daily", methods=["GET"])
+@jwt_required()
+def get_status_daily():
+        conn = get_db_connection()
+        if conn is None:
+                return jsonify({"success": False, "error": "資料庫連線失敗"}), 500
+        try:
+                end = datetime.strptime(request.args["to"], "%Y-%m-%d").date() if request.args.get("to") else datetime.now().date()
+                start = datetime.strptime(request.args["from"], "%Y-%m-%d").date() if request.args.get("from") else end - timedelta(days=29)
+        except ValueError:
+                return jsonify({"success": False, "error": "日期格式應為 YYYY-MM-DD"}), 400
+        if start > end or (end - start).days > 366:
+                return jsonify({"success": False, "error": "日期範圍不正確 (最多 366 天)"}), 400
+        try:
+                cursor = conn.cursor()
+                return jsonify({
+                        "success": True,
+                        "data": rollup.status_daily(cursor, start, end),
+                        "watermarks": rollup.watermarks(cursor)
+                }), 200
+        except Exception as e:
+                print(f"❌ 獲取每日狀態統計錯誤: {e}")
+                return jsonify({"success": False, "error": "伺服器錯誤"}), 500
+
+# 各狀態停留的時間
+@app.route("/api/analytics/status_durations", methods=["GET"])
+@jwt_required()
+def get_status_durations():
+        conn = get_db_connection()
+        if conn is None:
+                return jsonify({"success": False, "error": "資料庫連線失敗"}), 500
+        try:
+                cursor = conn.cursor()
+                return jsonify({
+                        "success": True,
+                        "data": rollup.status_durations(cursor),
+                        "watermarks": rollup.watermarks(cursor)
+                }), 200
+        except Exception as e:
+                print(f"❌ 獲取狀態停留時間錯誤: {e}")
+                return jsonify({"success": False, "error": "伺服器錯誤"}), 500
+
+# 各問題類型的回報處理時間
+@app.route("/api/analytics/report_turnaround", methods=["GET"])
+@jwt_required()
+def get_report_turnaround():
+        conn = get_db_connection()
+        if conn is None:
+                return jsonify({"success": False, "error": "資料庫連線失敗"}), 500
+        try:
+                cursor = conn.cursor()
+                return jsonify({
+                        "success": True,
+                        "data": rollup.report_turnaround(cursor),
+                        "watermarks": rollup.watermarks(cursor)
+                }), 200
+        except Exception as e:
+                print(f"❌ 獲取回報處理時間錯誤: {e}")
+                return jsonify({"success": False, "error": "伺服器錯誤"}), 500
+
 @app.route('/uploads/<filename>')
 def uploaded_file(filename):
         try:
@@ -841,10 +1192,112 @@ def uploaded_file(filename):
         # 如果檔案不存在，返回 404 錯誤
                 return jsonify({"success": False, "error": "圖片檔案不存在"}), 404
 
+# ===============================================
+# 日誌歸檔指令 (flask --app app archive-logs / restore-logs)
+# ===============================================
+@app.cli.command("archive-logs")
+@click.option("--days", type=int, default=None, help="搬移超過幾天的日誌，預設為 LOG_ARCHIVE_DAYS")
+@click.option("--limit", type=int, default=archive.DEFAULT_ARCHIVE_LIMIT, help="單次最多搬移的筆數")
+def archive_logs_command(days, limit):
+        conn = get_db_connection()
+        if conn is None:
+                raise click.ClickException("資料庫連線失敗")
+        days = days if days is not None else app.config['LOG_ARCHIVE_DAYS']
+        moved = archive.archive_logs(conn, app.config['LOG_ARCHIVE_DIR'], days, limit)
+        click.echo(f"✅ 已歸檔 {moved} 筆超過 {days} 天的日誌")
+
+@app.cli.command("restore-logs")
+@click.argument("ccm_id", required=False)
+def restore_logs_command(ccm_id):
+        conn = get_db_connection()
+        if conn is None:
+                raise click.ClickException("資料庫連線失敗")
+        restored = archive.restore_logs(conn, app.config['LOG_ARCHIVE_DIR'], ccm_id)
+        target = ccm_id if ccm_id else "全部器材"
+        click.echo(f"✅ 已還原 {restored} 筆日誌 ({target})")
+
+@app.cli.command("import-equipment")
+@click.argument("path", type=click.Path(exists=True, dir_okay=False))
+@click.option("--user", "current_user", required=True, help="寫入 CC_LOG 的 UPDATE_BY")
+def import_equipment_command(path, current_user):
+        conn = get_db_connection()
+        if conn is None:
+                raise click.ClickException("資料庫連線失敗")
+        try:
+                with open(path, "rb") as f:
+                        result = bulk.import_equipment(conn, f, path, current_user)
+        except bulk.ImportFormatError as e:
+                raise click.ClickException(str(e))
+        for error in result["errors"]:
+                click.echo(f"❌ 第 {error['row']} 列 ({error['CCM_ID']}): {error['error']}")
+        click.echo(f"✅ 已匯入 {result['imported']}/{result['total']} 筆")
+
+@app.cli.command("rollup-refresh")
+@click.option("--rebuild", is_flag=True, help="清空彙總表後從頭計算")
+def rollup_refresh_command(rebuild):
+        conn = get_db_connection()
+        if conn is None:
+                raise click.ClickException("資料庫連線失敗")
+        result = rollup.rebuild(conn) if rebuild else rollup.refresh(conn)
+        if result is None:
+                click.echo("⚠️ 另一個程序正在更新統計彙總")
+        else:
+                click.echo(f"✅ 已處理 {result['logs']} 筆日誌")
+
+# ===============================================
+# 資料庫版本與索引指令 (flask --app app db-migrate / db-check)
+# ===============================================
+@app.cli.command("db-migrate")
+@click.option("--target", type=int, default=None, help="只套用到指定版本")
+def db_migrate_command(target):
+        conn = get_db_connection()
+        if conn is None:
+                raise click.ClickException("資料庫連線失敗")
+        applied = migrations.migrate(conn, target)
+        if not applied:
+                click.echo("✅ 資料庫已是最新版本")
+        for version, name in applied:
+                click.echo(f"✅ 已套用版本 {version}: {name}")
+
+@app.cli.command("db-check")
+@click.option("--apply", "apply_changes", is_flag=True, help="套用尚未執行的版本，並列出前後的執行計畫差異")
+def db_check_command(apply_changes):
+        conn = get_db_connection()
+        if conn is None:
+                raise click.ClickException("資料庫連線失敗")
+
+        # 不加 --apply 時只讀取，不建立 CC_SCHEMA_VERSION
+        for version, name, _statements in migrations.pending_migrations(conn, create=apply_changes):
+                click.echo(f"⚠️ 尚未套用版本 {version}: {name}")
+        missing = migrations.missing_indexes(conn)
+        for table, columns, purpose in missing:
+                click.echo(f"❌ 缺少索引 {table}({', '.join(columns)}) - {purpose}")
+        if not missing:
+                click.echo("✅ 熱門查詢需要的索引都已存在")
+
+        before = migrations.query_plans(conn)
+        if not apply_changes:
+                click.echo(migrations.format_plan_diff(before))
+                return
+        for version, name in migrations.migrate(conn):
+                click.echo(f"✅ 已套用版本 {version}: {name}")
+        after = migrations.query_plans(conn)
+        click.echo(migrations.format_plan_diff(before, after))
+
 # ===============================================
 # 伺服器運行
 # ===============================================
 if __name__ == '__main__':
+        # 啟動時先建立搜尋索引與帳號快取，失敗時改在第一次使用時載入
+        try:
+                with app.app_context():
+                        conn = get_db_connection()
+                        ensure_search_index()
+                        user_directory.refresh(conn)
+        except Exception as e:
+                logging.error(f"啟動時建立搜尋索引與帳號快取失敗: {e}")
+        if app.config['ROLLUP_INTERVAL'] > 0:
+                rollup.start_worker(lambda: pyodbc.connect(conn_str), app.config['ROLLUP_INTERVAL'])
         app.run(host='0.0.0.0', port=5172, debug=True)
         server = pywsgi.WSGIServer(('0.0.0.0', 5172), app)
         server.serve_forever()
\ No newline at end of file
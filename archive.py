@@ -0,0 +1,317 @@
+# archive.py
+# CC_LOG 歸檔：把超過保存期限的日誌搬到本機的壓縮分段檔 (gzip JSONL)，
+# 並提供依 CCM_ID 查詢與還原的功能。
+#
+# 目錄結構：
+#   <archive_dir>/index.json              分段與 CCM_ID 索引
+#   <archive_dir>/cc_log_<時間戳>.jsonl.gz 只會附加、不會修改的分段檔
+#
+# 每個分段檔內，同一個 CCM_ID 的日誌會寫成獨立的 gzip member，
+# 索引記錄該 member 的位移與長度，讀取時只需解壓縮該 CCM_ID 的資料。
+
+import copy
+import gzip
+import heapq
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+INDEX_FILENAME = "index.json"
+INDEX_VERSION = 1
+
+# 每次歸檔最多搬移的筆數，避免一次佔用過多記憶體與交易時間
+DEFAULT_ARCHIVE_LIMIT = 50000
+
+_index_lock = threading.Lock()
+_index_cache = {}
+
+
+def _index_path(archive_dir):
+    return os.path.join(archive_dir, INDEX_FILENAME)
+
+
+def _empty_index():
+    return {"version": INDEX_VERSION, "segments": {}, "items": {}}
+
+
+def load_index(archive_dir):
+    """讀取索引檔，依修改時間快取，檔案不存在時回傳空索引。"""
+    path = _index_path(archive_dir)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return _empty_index()
+
+    version = (stat.st_mtime_ns, stat.st_size)
+    cached = _index_cache.get(path)
+    if cached and cached[0] == version:
+        return cached[1]
+
+    with open(path, "r", encoding="utf-8") as f:
+        index = json.load(f)
+    _index_cache[path] = (version, index)
+    return index
+
+
+def _load_index_for_update(archive_dir):
+    # 快取中的索引可能被其他請求共用，修改前先複製一份
+    return copy.deepcopy(load_index(archive_dir))
+
+
+def _save_index(archive_dir, index):
+    # 先寫暫存檔再改名，確保其他 worker 不會讀到寫一半的索引
+    path = _index_path(archive_dir)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(index, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+    _index_cache.pop(path, None)
+
+
+def _encode_row(row, dt_cols):
+    encoded = {}
+    for key, value in row.items():
+        if isinstance(value, datetime):
+            dt_cols.add(key)
+            value = value.isoformat()
+        encoded[key] = value
+    return encoded
+
+
+def _decode_row(row, dt_cols):
+    for key in dt_cols:
+        if row.get(key):
+            row[key] = datetime.fromisoformat(row[key])
+    return row
+
+
+def sort_key(row):
+    """日誌排序鍵：UPDATE_TIME 新到舊，相同時間再依 CCL_ID。"""
+    return (row.get("UPDATE_TIME") or datetime.min, row.get("CCL_ID") or 0)
+
+
+# ===============================================
+# 讀取
+# ===============================================
+def archived_count(archive_dir, ccm_id):
+    index = load_index(archive_dir)
+    return sum(entry[3] for entry in index["items"].get(ccm_id, []))
+
+
+def archived_counts(archive_dir):
+    """回傳 {CCM_ID: 已歸檔筆數}，供 UPD_CNT 補上歸檔的部分。"""
+    index = load_index(archive_dir)
+    return {
+        ccm_id: sum(entry[3] for entry in entries)
+        for ccm_id, entries in index["items"].items()
+    }
+
+
+def read_archived_logs(archive_dir, ccm_id):
+    """讀出某個 CCM_ID 所有已歸檔的日誌，依 UPDATE_TIME 由新到舊排序。"""
+    index = load_index(archive_dir)
+    rows = []
+    for segment, offset, length, _count in index["items"].get(ccm_id, []):
+        dt_cols = index["segments"].get(segment, {}).get("dt_cols", [])
+        with open(os.path.join(archive_dir, segment), "rb") as f:
+            f.seek(offset)
+            payload = gzip.decompress(f.read(length))
+        for line in payload.splitlines():
+            if line:
+                rows.append(_decode_row(json.loads(line), dt_cols))
+    rows.sort(key=sort_key, reverse=True)
+    return rows
+
+
+def merge_history(hot_rows, archived_rows, offset=0, limit=None):
+    """
+    合併資料庫中的日誌與歸檔日誌 (兩者皆須已由新到舊排序)，
+    以 CCL_ID 去除重複 (歸檔進行中可能短暫同時存在)，再做分頁。
+    """
+    merged = heapq.merge(hot_rows, archived_rows, key=sort_key, reverse=True)
+    seen = set()
+    result = []
+    skipped = 0
+    for row in merged:
+        ccl_id = row.get("CCL_ID")
+        if ccl_id is not None:
+            if ccl_id in seen:
+                continue
+            seen.add(ccl_id)
+        if skipped < offset:
+            skipped += 1
+            continue
+        result.append(row)
+        if limit is not None and len(result) >= limit:
+            break
+    return result
+
+
+# ===============================================
+# 歸檔
+# ===============================================
+def _write_segment(archive_dir, groups):
+    """把 {CCM_ID: [row, ...]} 寫成一個新的分段檔，回傳 (檔名, 索引項目, 日期欄位)。"""
+    os.makedirs(archive_dir, exist_ok=True)
+    segment = f"cc_log_{datetime.now().strftime('%Y%m%d%H%M%S%f')}.jsonl.gz"
+    tmp_path = os.path.join(archive_dir, f"{segment}.tmp")
+    dt_cols = set()
+    entries = {}
+
+    with open(tmp_path, "wb") as f:
+        for ccm_id, rows in groups.items():
+            payload = "".join(
+                json.dumps(_encode_row(row, dt_cols), ensure_ascii=False, default=str) + "\n"
+                for row in rows
+            ).encode("utf-8")
+            member = gzip.compress(payload)
+            offset = f.tell()
+            f.write(member)
+            entries[ccm_id] = [segment, offset, len(member), len(rows)]
+        f.flush()
+        os.fsync(f.fileno())
+
+    os.replace(tmp_path, os.path.join(archive_dir, segment))
+    return segment, entries, sorted(dt_cols)
+
+
+def archive_logs(conn, archive_dir, days, limit=DEFAULT_ARCHIVE_LIMIT):
+    """
+    將 UPDATE_TIME 早於 days 天前的日誌搬到歸檔分段檔並從 CC_LOG 刪除。
+    每個器材的最新一筆 (最大 CCL_ID 與最大 UPDATE_TIME) 會保留在資料庫，
+    器材列表與狀態統計才能維持正確。回傳搬移的筆數。
+
+    由最舊的日誌開始搬移，limit 在某個器材中途截斷時留在資料庫的也是較新的那些，
+    因此每個器材的歸檔日誌一定比資料庫中的舊 (讀取歷史時依此略過不需要的歸檔)。
+    """
+    cutoff = datetime.now() - timedelta(days=days)
+    cursor = conn.cursor()
+    cursor.execute(
+        """
+        SELECT TOP (?) L.*
+        FROM CC_LOG L
+        WHERE L.UPDATE_TIME < ?
+          AND L.CCL_ID < (SELECT MAX(CCL_ID) FROM CC_LOG WHERE CC_ID_FK = L.CC_ID_FK)
+          AND L.UPDATE_TIME < (SELECT MAX(UPDATE_TIME) FROM CC_LOG WHERE CC_ID_FK = L.CC_ID_FK)
+        ORDER BY L.UPDATE_TIME ASC, L.CCL_ID ASC
+        """,
+        limit, cutoff
+    )
+    columns = [column[0] for column in cursor.description]
+
+    groups = {}
+    ccl_ids = []
+    while True:
+        batch = cursor.fetchmany(1000)
+        if not batch:
+            break
+        for row in batch:
+            record = dict(zip(columns, row))
+            groups.setdefault(record["CC_ID_FK"], []).append(record)
+            ccl_ids.append(record["CCL_ID"])
+
+    if not ccl_ids:
+        return 0
+
+    with _index_lock:
+        segment, entries, dt_cols = _write_segment(archive_dir, groups)
+        index = _load_index_for_update(archive_dir)
+        index["segments"][segment] = {
+            "created": datetime.now().isoformat(),
+            "rows": len(ccl_ids),
+            "cutoff": cutoff.isoformat(),
+            "dt_cols": dt_cols,
+        }
+        for ccm_id, entry in entries.items():
+            index["items"].setdefault(ccm_id, []).append(entry)
+        # 先發布索引再刪除資料庫的資料；中間時段的重複由 merge_history 以 CCL_ID 去除
+        _save_index(archive_dir, index)
+
+        try:
+            cursor.fast_executemany = True
+            cursor.executemany(
+                "DELETE FROM CC_LOG WHERE CCL_ID = ?",
+                [(ccl_id,) for ccl_id in ccl_ids]
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            _drop_segment(archive_dir, segment)
+            raise
+
+    logging.info(f"已歸檔 {len(ccl_ids)} 筆日誌到 {segment}")
+    return len(ccl_ids)
+
+
+def _drop_segment(archive_dir, segment):
+    index = _load_index_for_update(archive_dir)
+    index["segments"].pop(segment, None)
+    for ccm_id in list(index["items"]):
+        entries = [e for e in index["items"][ccm_id] if e[0] != segment]
+        if entries:
+            index["items"][ccm_id] = entries
+        else:
+            del index["items"][ccm_id]
+    _save_index(archive_dir, index)
+    path = os.path.join(archive_dir, segment)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+# ===============================================
+# 還原
+# ===============================================
+def restore_logs(conn, archive_dir, ccm_id=None):
+    """
+    把歸檔的日誌寫回 CC_LOG (保留原本的 CCL_ID)，並從索引中移除。
+    未指定 ccm_id 時還原全部。已不被任何器材引用的分段檔會一併刪除。
+    回傳寫回的筆數。
+    """
+    with _index_lock:
+        index = _load_index_for_update(archive_dir)
+        ccm_ids = [ccm_id] if ccm_id else list(index["items"])
+        ccm_ids = [c for c in ccm_ids if c in index["items"]]
+        if not ccm_ids:
+            return 0
+
+        cursor = conn.cursor()
+        restored = 0
+        try:
+            cursor.execute("SET IDENTITY_INSERT CC_LOG ON")
+            for item_id in ccm_ids:
+                rows = read_archived_logs(archive_dir, item_id)
+                cursor.execute("SELECT CCL_ID FROM CC_LOG WHERE CC_ID_FK = ?", item_id)
+                existing = {row[0] for row in cursor.fetchall()}
+                rows = [row for row in rows if row.get("CCL_ID") not in existing]
+                if not rows:
+                    continue
+                columns = list(rows[0].keys())
+                placeholders = ", ".join("?" for _ in columns)
+                cursor.fast_executemany = True
+                cursor.executemany(
+                    f"INSERT INTO CC_LOG ({', '.join(columns)}) VALUES ({placeholders})",
+                    [tuple(row.get(column) for column in columns) for row in rows]
+                )
+                restored += len(rows)
+            cursor.execute("SET IDENTITY_INSERT CC_LOG OFF")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+        for item_id in ccm_ids:
+            index["items"].pop(item_id, None)
+        referenced = {e[0] for entries in index["items"].values() for e in entries}
+        orphaned = [s for s in index["segments"] if s not in referenced]
+        for segment in orphaned:
+            del index["segments"][segment]
+        _save_index(archive_dir, index)
+        for segment in orphaned:
+            path = os.path.join(archive_dir, segment)
+            if os.path.exists(path):
+                os.remove(path)
+
+    logging.info(f"已從歸檔還原 {restored} 筆日誌")
+    return restored
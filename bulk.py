@@ -0,0 +1,279 @@
+# bulk.py
+# 器材批次匯入 (CSV / XLSX) 與串流匯出 (CSV)。
+# 匯入時分批驗證與寫入，每批一個交易；匯出時以 fetchmany 逐批讀取，不會一次載入全部資料。
+
+import codecs
+import csv
+import io
+import logging
+import os
+from datetime import datetime
+
+import archive
+
+IMPORT_COLUMNS = [
+    "CCM_ID", "CC_SIZE", "BOX_ID", "USER_NAME", "CC_STARTTIME",
+    "CC_STATUS", "CC_SUBSTATUS", "COMMENT",
+]
+IMPORT_CHUNK_SIZE = 500
+EXPORT_FETCH_SIZE = 1000
+MAX_FIELD_LENGTH = 50
+
+EQUIPMENT_EXPORT_SQL = """
+    SELECT
+        M.CCM_ID, M.CC_SIZE, M.BOX_ID, M.USER_NAME, M.CC_STARTTIME, M.UPD_CNT,
+        L.CC_STATUS, L.CC_SUBSTATUS, L.COMMENT, L.UPDATE_BY, L.UPDATE_TIME
+    FROM CC_MASTER M
+    LEFT JOIN CC_LOG L ON M.CCM_ID = L.CC_ID_FK
+    WHERE L.CCL_ID = (SELECT MAX(CCL_ID) FROM CC_LOG WHERE CC_ID_FK = M.CCM_ID)
+       OR L.CCL_ID IS NULL
+    ORDER BY M.CCM_ID
+"""
+LOG_EXPORT_COLUMNS = [
+    "CCL_ID", "CC_ID_FK", "INPUT_DATE", "CC_STATUS", "CC_SUBSTATUS",
+    "UPDATE_BY", "UPDATE_TIME", "COMMENT",
+]
+LOG_EXPORT_SQL = f"SELECT {', '.join(LOG_EXPORT_COLUMNS)} FROM CC_LOG ORDER BY CCL_ID"
+
+UPSERT_MASTER_SQL = """
+    MERGE CC_MASTER WITH (HOLDLOCK) AS T
+    USING (SELECT ? AS CCM_ID, ? AS CC_SIZE, ? AS BOX_ID, ? AS USER_NAME, ? AS CC_STARTTIME) AS S
+    ON T.CCM_ID = S.CCM_ID
+    WHEN MATCHED THEN
+        UPDATE SET CC_SIZE = S.CC_SIZE, BOX_ID = S.BOX_ID, USER_NAME = S.USER_NAME,
+                   CC_STARTTIME = S.CC_STARTTIME, UPD_CNT = ISNULL(T.UPD_CNT, 0) + 1
+    WHEN NOT MATCHED THEN
+        INSERT (CCM_ID, CC_SIZE, BOX_ID, USER_NAME, CC_STARTTIME, UPD_CNT)
+        VALUES (S.CCM_ID, S.CC_SIZE, S.BOX_ID, S.USER_NAME, S.CC_STARTTIME, 0);
+"""
+INSERT_LOG_SQL = """
+    INSERT INTO CC_LOG (CC_ID_FK, INPUT_DATE, CC_STATUS, CC_SUBSTATUS, UPDATE_BY, UPDATE_TIME, COMMENT)
+    VALUES (?, ?, ?, ?, ?, GETDATE(), ?)
+"""
+
+
+class ImportFormatError(ValueError):
+    """上傳的檔案無法解析 (格式不支援或缺少必要欄位)。"""
+
+
+# ===============================================
+# 讀取檔案
+# ===============================================
+def _normalize(value):
+    if isinstance(value, str):
+        value = value.strip()
+        return value or None
+    return value
+
+
+def _iter_csv(stream):
+    # 不用 io.TextIOWrapper：Python 3.10 的 SpooledTemporaryFile (Werkzeug 上傳檔案) 沒有 readable()
+    text = codecs.getreader("utf-8-sig")(stream)
+    reader = csv.reader(text)
+    header = next(reader, None)
+    if header is None:
+        return
+    yield [h.strip().upper() for h in header]
+    for row in reader:
+        yield row
+
+
+def _iter_xlsx(stream):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ImportFormatError("伺服器未安裝 openpyxl，無法讀取 XLSX 檔案")
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        yield [str(h or "").strip().upper() for h in header]
+        for row in rows:
+            yield list(row)
+    finally:
+        workbook.close()
+
+
+def iter_import_rows(stream, filename):
+    """依副檔名讀取 CSV / XLSX，逐筆產生 (列號, {欄位: 值})，列號從 2 開始 (第 1 列為標題)。"""
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext == ".csv":
+        raw_rows = _iter_csv(stream)
+    elif ext in (".xlsx", ".xlsm"):
+        raw_rows = _iter_xlsx(stream)
+    else:
+        raise ImportFormatError("只支援 CSV 或 XLSX 檔案")
+
+    header = next(raw_rows, None)
+    if not header or "CCM_ID" not in header:
+        raise ImportFormatError("檔案第一列必須是欄位名稱，且包含 CCM_ID")
+    positions = {column: header.index(column) for column in IMPORT_COLUMNS if column in header}
+
+    for line_no, values in enumerate(raw_rows, start=2):
+        if not any(_normalize(v) is not None for v in values):
+            continue  # 跳過空白列
+        yield line_no, {
+            column: _normalize(values[pos]) if pos < len(values) else None
+            for column, pos in positions.items()
+        }
+
+
+# ===============================================
+# 驗證
+# ===============================================
+def _parse_datetime(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    text = str(value).replace("/", "-").replace("T", " ")
+    return datetime.fromisoformat(text)
+
+
+def validate_row(row):
+    """驗證並轉換一列資料，回傳 (清理後的資料, 錯誤訊息)。"""
+    ccm_id = row.get("CCM_ID")
+    if ccm_id is None:
+        return None, "CCM ID 是必填項"
+    cleaned = {column: row.get(column) for column in IMPORT_COLUMNS}
+    cleaned["CCM_ID"] = str(ccm_id)
+    for column in ("CCM_ID", "CC_SIZE", "BOX_ID", "USER_NAME", "CC_STATUS", "CC_SUBSTATUS"):
+        value = cleaned[column]
+        if value is not None:
+            value = str(value)
+            if len(value) > MAX_FIELD_LENGTH:
+                return None, f"{column} 長度超過 {MAX_FIELD_LENGTH} 字元"
+            cleaned[column] = value
+    try:
+        cleaned["CC_STARTTIME"] = _parse_datetime(cleaned["CC_STARTTIME"])
+    except ValueError:
+        return None, f"CC_STARTTIME 日期格式錯誤: {row.get('CC_STARTTIME')}"
+    return cleaned, None
+
+
+# ===============================================
+# 匯入
+# ===============================================
+def _write_chunk(cursor, chunk, current_user):
+    cursor.fast_executemany = True
+    cursor.executemany(UPSERT_MASTER_SQL, [
+        (r["CCM_ID"], r["CC_SIZE"], r["BOX_ID"], r["USER_NAME"], r["CC_STARTTIME"])
+        for _line, r in chunk
+    ])
+    log_rows = [
+        (r["CCM_ID"], r["CC_STARTTIME"], r["CC_STATUS"], r["CC_SUBSTATUS"], current_user, r["COMMENT"])
+        for _line, r in chunk if r["CC_STATUS"]
+    ]
+    if log_rows:
+        cursor.executemany(INSERT_LOG_SQL, log_rows)
+
+
+def _flush_chunk(conn, chunk, current_user, errors):
+    """寫入一批資料；整批失敗時改成逐筆寫入，找出有問題的那幾列。回傳成功筆數。"""
+    cursor = conn.cursor()
+    try:
+        _write_chunk(cursor, chunk, current_user)
+        conn.commit()
+        return len(chunk)
+    except Exception as e:
+        conn.rollback()
+        logging.warning(f"批次匯入整批寫入失敗，改為逐筆寫入: {e}")
+
+    imported = 0
+    for line_no, row in chunk:
+        try:
+            _write_chunk(cursor, [(line_no, row)], current_user)
+            conn.commit()
+            imported += 1
+        except Exception as e:
+            conn.rollback()
+            errors.append({"row": line_no, "CCM_ID": row["CCM_ID"], "error": str(e)})
+    return imported
+
+
+def import_equipment(conn, stream, filename, current_user, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    匯入器材檔案：CC_MASTER 以 CCM_ID 做 upsert，有 CC_STATUS 的列另外寫一筆 CC_LOG。
+    回傳 {"total", "imported", "errors": [{"row", "CCM_ID", "error"}]}。
+    """
+    errors = []
+    seen = set()
+    chunk = []
+    total = 0
+    imported = 0
+
+    for line_no, raw in iter_import_rows(stream, filename):
+        total += 1
+        row, error = validate_row(raw)
+        if error is None and row["CCM_ID"] in seen:
+            error = "CCM ID 在檔案中重複"
+        if error:
+            errors.append({"row": line_no, "CCM_ID": raw.get("CCM_ID"), "error": error})
+            continue
+        seen.add(row["CCM_ID"])
+        chunk.append((line_no, row))
+        if len(chunk) >= chunk_size:
+            imported += _flush_chunk(conn, chunk, current_user, errors)
+            chunk = []
+
+    if chunk:
+        imported += _flush_chunk(conn, chunk, current_user, errors)
+
+    errors.sort(key=lambda e: e["row"])
+    return {"total": total, "imported": imported, "errors": errors}
+
+
+# ===============================================
+# 匯出
+# ===============================================
+def _format_value(value):
+    if isinstance(value, datetime):
+        return value.strftime("%Y-%m-%d %H:%M:%S")
+    return value
+
+
+def _csv_chunks(columns, row_batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # 加上 BOM，Excel 開啟時中文才不會變成亂碼
+    buffer.write("\ufeff")
+    writer.writerow(columns)
+    for batch in row_batches:
+        for row in batch:
+            writer.writerow([_format_value(value) for value in row])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def _fetch_batches(cursor, size=EXPORT_FETCH_SIZE):
+    while True:
+        batch = cursor.fetchmany(size)
+        if not batch:
+            break
+        yield batch
+
+
+def export_equipment_csv(conn):
+    """逐批產生器材與目前狀態的 CSV 內容。"""
+    cursor = conn.cursor()
+    cursor.execute(EQUIPMENT_EXPORT_SQL)
+    columns = [column[0] for column in cursor.description]
+    yield from _csv_chunks(columns, _fetch_batches(cursor))
+
+
+def export_logs_csv(conn, archive_dir=None):
+    """逐批產生完整日誌歷史的 CSV 內容；指定 archive_dir 時會先輸出已歸檔的日誌。"""
+    def batches():
+        if archive_dir:
+            for ccm_id in archive.load_index(archive_dir)["items"]:
+                rows = archive.read_archived_logs(archive_dir, ccm_id)
+                rows.reverse()
+                yield [[row.get(column) for column in LOG_EXPORT_COLUMNS] for row in rows]
+        cursor = conn.cursor()
+        cursor.execute(LOG_EXPORT_SQL)
+        yield from _fetch_batches(cursor)
+
+    yield from _csv_chunks(LOG_EXPORT_COLUMNS, batches())
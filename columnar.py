@@ -0,0 +1,99 @@
+# columnar.py
+# 列表 API 的精簡回應格式：欄位名稱只送一次，資料以「每個欄位一個陣列」傳送。
+# 可用 ?format=columnar / ?format=msgpack，或 Accept 標頭選擇；預設仍為原本的 JSON。
+#
+# {"success": true, "columns": ["CCM_ID", ...], "data": [[...CCM_ID 值], [...]], "count": N}
+#
+# 直接從 cursor 分批轉置成欄位陣列，不會為每一列建立 dict。
+
+import decimal
+from datetime import date
+
+from werkzeug.http import http_date
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_MIMETYPE = "application/json"
+COLUMNAR_JSON_MIMETYPE = "application/vnd.ccbackend.columnar+json"
+MSGPACK_MIMETYPE = "application/x-msgpack"
+
+FORMAT_ALIASES = {
+    "columnar": "columnar",
+    "compact": "columnar",
+    "msgpack": "msgpack",
+}
+FETCH_SIZE = 1000
+
+
+class UnsupportedFormatError(ValueError):
+    """要求的格式不存在，或需要的套件 (msgpack) 未安裝。"""
+
+
+def requested_format(request):
+    """回傳 None (原本的 JSON)、"columnar" 或 "msgpack"。?format= 優先於 Accept。"""
+    fmt = request.args.get("format")
+    if fmt:
+        fmt = fmt.lower()
+        if fmt == "json":
+            return None
+        if fmt not in FORMAT_ALIASES:
+            raise UnsupportedFormatError(f"不支援的格式: {fmt}")
+        fmt = FORMAT_ALIASES[fmt]
+    else:
+        best = request.accept_mimetypes.best_match(
+            [JSON_MIMETYPE, COLUMNAR_JSON_MIMETYPE, MSGPACK_MIMETYPE], default=JSON_MIMETYPE
+        )
+        fmt = {COLUMNAR_JSON_MIMETYPE: "columnar", MSGPACK_MIMETYPE: "msgpack"}.get(best)
+    if fmt == "msgpack" and msgpack is None:
+        raise UnsupportedFormatError("伺服器未安裝 msgpack")
+    return fmt
+
+
+def build_columns(cursor, formatters=None, fetch_size=FETCH_SIZE):
+    """
+    讀完 cursor 的結果並轉成 (欄位名稱, 欄位陣列)。
+    formatters 為 {欄位名稱: 函式}，在轉置後整欄套用。
+    """
+    columns = [column[0] for column in cursor.description]
+    data = [[] for _ in columns]
+    while True:
+        batch = cursor.fetchmany(fetch_size)
+        if not batch:
+            break
+        for values, column_values in zip(data, zip(*batch)):
+            values.extend(column_values)
+
+    for name, formatter in (formatters or {}).items():
+        if name in columns:
+            position = columns.index(name)
+            data[position] = [formatter(value) for value in data[position]]
+    return columns, data
+
+
+def _msgpack_default(value):
+    # 與 JSON provider 相同的轉換規則，兩種格式內容一致
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not msgpack serializable")
+
+
+def make_response(app, fmt, columns, data):
+    payload = {
+        "success": True,
+        "columns": columns,
+        "data": data,
+        "count": len(data[0]) if data else 0,
+    }
+    if fmt == "msgpack":
+        body = msgpack.packb(payload, default=_msgpack_default, use_bin_type=True)
+        response = app.response_class(body, mimetype=MSGPACK_MIMETYPE)
+    else:
+        response = app.json.response(payload)
+        response.mimetype = COLUMNAR_JSON_MIMETYPE
+    response.vary.add("Accept")
+    return response
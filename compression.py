@@ -0,0 +1,151 @@
+# compression.py
+# 依 Accept-Encoding 協商回應壓縮 (zstd / br / gzip)。
+# 小於門檻的回應不壓縮；GET 回應的壓縮結果依內容雜湊快取，輪詢時相同內容不需重新壓縮。
+
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+from flask import request
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = {
+    "application/json", "application/vnd.ccbackend.columnar+json", "application/x-msgpack",
+    "text/html", "text/plain", "text/csv", "text/css", "application/javascript",
+}
+
+DEFAULT_MIN_SIZE = 1024
+DEFAULT_CACHE_BYTES = 32 * 1024 * 1024
+
+
+def _compress_gzip(data):
+    return gzip.compress(data, compresslevel=6, mtime=0)
+
+
+def _compress_brotli(data):
+    return brotli.compress(data, quality=5)
+
+
+def _compress_zstd(data):
+    return zstandard.ZstdCompressor(level=3).compress(data)
+
+
+# 伺服器偏好的順序，實際可用的依已安裝的套件而定
+ENCODERS = OrderedDict()
+if zstandard is not None:
+    ENCODERS["zstd"] = _compress_zstd
+if brotli is not None:
+    ENCODERS["br"] = _compress_brotli
+ENCODERS["gzip"] = _compress_gzip
+
+
+class CompressedCache:
+    """以 (編碼, 內容雜湊) 為 key 的 LRU 快取，依總位元組數限制大小。"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._size -= len(old)
+            self._items[key] = value
+            self._size += len(value)
+            while self._size > self.max_bytes:
+                _key, evicted = self._items.popitem(last=False)
+                self._size -= len(evicted)
+
+
+def parse_accept_encoding(header):
+    """解析 Accept-Encoding，回傳 {編碼: q 值}。"""
+    accepted = {}
+    for part in (header or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        name, _, params = part.partition(";")
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[name.strip().lower()] = q
+    return accepted
+
+
+def choose_encoding(header):
+    """從客戶端接受的編碼中選出 q 值最高者，q 值相同時依伺服器偏好順序。"""
+    accepted = parse_accept_encoding(header)
+    best, best_q = None, 0.0
+    for encoding in ENCODERS:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def init_app(app):
+    min_size = app.config.setdefault("COMPRESS_MIN_SIZE", DEFAULT_MIN_SIZE)
+    cache = CompressedCache(app.config.setdefault("COMPRESS_CACHE_BYTES", DEFAULT_CACHE_BYTES))
+
+    @app.after_request
+    def compress_response(response):
+        if (
+            response.direct_passthrough
+            or response.is_streamed
+            or response.status_code != 200
+            or "Content-Encoding" in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        ):
+            return response
+
+        response.vary.add("Accept-Encoding")
+        encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+        if encoding is None:
+            return response
+
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+
+        # 只快取 GET 回應：輪詢的內容多半不變，雜湊比壓縮便宜得多
+        key = None
+        compressed = None
+        if request.method == "GET":
+            key = (encoding, hashlib.blake2b(data, digest_size=16).digest())
+            compressed = cache.get(key)
+        if compressed is None:
+            compressed = ENCODERS[encoding](data)
+            if key is not None:
+                cache.put(key, compressed)
+
+        response.set_data(compressed)
+        response.headers["Content-Encoding"] = encoding
+        return response
+
+    return cache
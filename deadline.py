@@ -0,0 +1,204 @@
+# deadline.py
+# 每個請求的截止時間與查詢逾時。
+#
+# - 每個路由有自己的時間上限 (ROUTE_TIMEOUTS，其餘用預設值)，客戶端可用 X-Request-Timeout 縮短
+# - 資料庫連線包成 DeadlineConnection：每次建立 cursor 時把 pyodbc 的 query timeout
+#   (SQL_ATTR_QUERY_TIMEOUT) 設為剩餘時間，所以傳入連線的函式都會遵守同一個截止時間
+# - 背景 watchdog 在截止時間已過或客戶端已斷線時對執行中的 cursor 呼叫 cancel()，
+#   讓卡住的查詢儘快釋放連線與 worker
+
+import logging
+import math
+import select
+import selectors
+import socket
+import ssl
+import threading
+import time
+
+DEFAULT_TIMEOUT = 15
+WATCH_INTERVAL = 0.5
+
+# 路由 (endpoint 名稱) 的時間上限 (秒)；None 表示不設請求截止時間 (例如串流匯出)
+# 批次匯入逐批 commit，中途逾時會留下部分資料卻沒有錯誤報告，因此不設截止時間
+# (每個查詢仍受 DB_STATEMENT_TIMEOUT 限制)
+ROUTE_TIMEOUTS = {
+    "get_equipment_data": 20,
+    "get_status_counts": 10,
+    "get_log_history": 10,
+    "get_batch_log_history": 30,
+    "get_all_reports": 20,
+    "import_equipment": None,
+    "export_equipment": None,
+}
+
+
+class DeadlineExceeded(Exception):
+    """請求的截止時間已過，不再送出新的查詢。"""
+
+
+class RequestDeadline:
+    def __init__(self, seconds, client_socket=None):
+        self.expires_at = time.monotonic() + seconds if seconds else None
+        self.client_socket = client_socket
+        self.cancelled = False
+        self.reason = None
+        self._connections = []
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """剩餘秒數；沒有截止時間時回傳 None。"""
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    @property
+    def expired(self):
+        remaining = self.remaining()
+        return self.cancelled or (remaining is not None and remaining <= 0)
+
+    def disarm(self):
+        """開始串流回應後呼叫：已送出 200，之後再取消查詢只會讓回應被截斷。"""
+        with self._lock:
+            self.expires_at = None
+        watchdog.unregister(self)
+
+    def track(self, conn):
+        with self._lock:
+            self._connections.append(conn)
+
+    def cancel(self, reason):
+        with self._lock:
+            if self.cancelled:
+                return
+            self.cancelled = True
+            self.reason = reason
+            connections = list(self._connections)
+        for conn in connections:
+            conn.cancel()
+        logging.warning(f"已取消執行中的查詢 ({reason})")
+
+
+class DeadlineConnection:
+    """包裝 pyodbc 連線：建立 cursor 時套用剩餘時間作為查詢逾時，並記錄 cursor 以便取消。"""
+
+    def __init__(self, conn, request_deadline, statement_timeout):
+        self._conn = conn
+        self._deadline = request_deadline
+        self._statement_timeout = statement_timeout
+        self._cursors = []
+        request_deadline.track(self)
+
+    def cursor(self):
+        timeout = self._statement_timeout
+        remaining = self._deadline.remaining()
+        if self._deadline.cancelled or (remaining is not None and remaining <= 0):
+            raise DeadlineExceeded("請求已逾時")
+        if remaining is not None:
+            timeout = min(timeout, max(1, math.ceil(remaining))) if timeout else max(1, math.ceil(remaining))
+        self._conn.timeout = timeout or 0
+        cursor = self._conn.cursor()
+        self._cursors.append(cursor)
+        return cursor
+
+    def cancel(self):
+        for cursor in list(self._cursors):
+            try:
+                cursor.cancel()
+            except Exception as e:
+                logging.debug(f"取消查詢失敗: {e}")
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+def client_socket(environ):
+    """取得客戶端連線的 socket (werkzeug / gunicorn / gevent)，取不到時回傳 None。"""
+    sock = environ.get("werkzeug.socket") or environ.get("gunicorn.socket")
+    if sock is None:
+        sock = getattr(environ.get("wsgi.input"), "socket", None)
+    return sock if isinstance(sock, socket.socket) else None
+
+
+def _poll_readable(sock):
+    """socket 是否可讀 (不受 select() 的 fd < 1024 限制)；回傳 (可讀, 對方已掛斷)。"""
+    if hasattr(select, "poll"):
+        poller = select.poll()
+        poller.register(sock, select.POLLIN | select.POLLERR | select.POLLHUP)
+        events = poller.poll(0)
+        mask = events[0][1] if events else 0
+        return bool(mask & select.POLLIN), bool(mask & (select.POLLERR | select.POLLHUP))
+    with selectors.DefaultSelector() as selector:
+        selector.register(sock, selectors.EVENT_READ)
+        return bool(selector.select(0)), False
+
+
+def client_disconnected(sock):
+    """
+    socket 可讀但 peek 不到資料，表示對方已關閉連線。
+    無法判斷時 (例如 TLS socket 不支援 MSG_PEEK) 回傳 False，不取消查詢。
+    """
+    if sock is None:
+        return False
+    try:
+        readable, hung_up = _poll_readable(sock)
+        if hung_up:
+            return True
+        if not readable or isinstance(sock, ssl.SSLSocket):
+            return False
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except ValueError:
+        return False
+    except OSError:
+        return True
+
+
+def timeout_for(endpoint, default=DEFAULT_TIMEOUT, requested=None):
+    """
+    路由的時間上限，客戶端要求的時間 (X-Request-Timeout) 只能縮短不能延長。
+    ROUTE_TIMEOUTS 設為 None 的路由一律不設截止時間，不受 X-Request-Timeout 影響。
+    """
+    seconds = ROUTE_TIMEOUTS.get(endpoint, default)
+    if seconds is None:
+        return None
+    if requested and requested > 0:
+        seconds = min(seconds, requested) if seconds else requested
+    return seconds
+
+
+class Watchdog:
+    """背景執行緒：定期檢查進行中的請求，逾時或客戶端斷線就取消查詢。"""
+
+    def __init__(self, interval=WATCH_INTERVAL):
+        self.interval = interval
+        self._active = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def register(self, request_deadline):
+        with self._lock:
+            self._active.add(request_deadline)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-watchdog", daemon=True)
+                self._thread.start()
+
+    def unregister(self, request_deadline):
+        with self._lock:
+            self._active.discard(request_deadline)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            with self._lock:
+                active = list(self._active)
+            for item in active:
+                if item.cancelled:
+                    continue
+                remaining = item.remaining()
+                if remaining is not None and remaining <= 0:
+                    item.cancel("超過請求截止時間")
+                elif client_disconnected(item.client_socket):
+                    item.cancel("客戶端已斷線")
+
+
+watchdog = Watchdog()
@@ -0,0 +1,69 @@
+# history.py
+# 一次取得多個器材的日誌歷史：單一查詢以 ROW_NUMBER() 取每個器材最新的 K 筆，
+# 依 CCM_ID 分組後逐組產生，並合併已歸檔的日誌。
+
+import json
+
+import archive
+
+MAX_IDS = 1000
+FETCH_SIZE = 1000
+# 超過這個筆數就改用串流回應，避免整份結果留在記憶體
+STREAM_THRESHOLD = 5000
+
+BATCH_HISTORY_SQL = """
+    SELECT *
+    FROM (
+        SELECT L.*,
+               ROW_NUMBER() OVER (PARTITION BY L.CC_ID_FK ORDER BY L.UPDATE_TIME DESC, L.CCL_ID DESC) AS RN
+        FROM CC_LOG L
+        WHERE L.CC_ID_FK IN (SELECT value FROM OPENJSON(?))
+    ) AS T
+    WHERE ? IS NULL OR T.RN <= ?
+    ORDER BY T.CC_ID_FK, T.RN
+"""
+
+
+def box_item_ids(cursor, box_id):
+    cursor.execute("SELECT CCM_ID FROM CC_MASTER WHERE BOX_ID = ? ORDER BY CCM_ID", box_id)
+    return [row[0] for row in cursor.fetchall()]
+
+
+def iter_grouped_logs(cursor, ccm_ids, limit, archive_dir):
+    """
+    依 CCM_ID 分組產生 (ccm_id, [日誌 dict, ...])，每組由新到舊排序，最多 limit 筆。
+    沒有任何日誌的器材也會產生一組空列表。
+    """
+    cursor.execute(BATCH_HISTORY_SQL, json.dumps(ccm_ids), limit, limit)
+    columns = [column[0] for column in cursor.description if column[0] != "RN"]
+    width = len(columns)
+    archived_ids = archive.load_index(archive_dir)["items"] if archive_dir else {}
+
+    def finish(db_id, key, rows):
+        # 歸檔的日誌都比資料庫中的舊，資料庫裡的筆數不足 limit 時才需要讀取歸檔
+        # (最後一筆 UPDATE_TIME 為 NULL 時排序在歸檔之後，仍需合併)
+        needs_archive = limit is None or len(rows) < limit or rows[-1].get("UPDATE_TIME") is None
+        if db_id in archived_ids and needs_archive:
+            rows = archive.merge_history(rows, archive.read_archived_logs(archive_dir, db_id), 0, limit)
+        return key, rows
+
+    # SQL Server 比對不分大小寫、忽略尾端空白，這裡用相同規則對應回請求的 ID
+    remaining = {ccm_id.strip().upper(): ccm_id for ccm_id in ccm_ids}
+    current_id, current_key, current_rows = None, None, []
+    while True:
+        batch = cursor.fetchmany(FETCH_SIZE)
+        if not batch:
+            break
+        for row in batch:
+            record = dict(zip(columns, row[:width]))
+            if record["CC_ID_FK"] != current_id:
+                if current_id is not None:
+                    yield finish(current_id, current_key, current_rows)
+                current_id, current_rows = record["CC_ID_FK"], []
+                current_key = remaining.pop(current_id.strip().upper(), current_id)
+            current_rows.append(record)
+    if current_id is not None:
+        yield finish(current_id, current_key, current_rows)
+
+    for ccm_id in remaining.values():
+        yield ccm_id, []
@@ -0,0 +1,79 @@
+# json_provider.py
+# 以 orjson 取代 Flask 預設的 json 編碼器。
+# 輸出格式與預設 provider 相同 (日期為 HTTP 日期格式、Decimal 轉字串、key 排序)，
+# 差別只在速度，以及中文直接輸出 UTF-8 而不跳脫成 \uXXXX。
+
+import decimal
+from datetime import date
+
+from flask.json.provider import DefaultJSONProvider
+from werkzeug.http import http_date
+
+try:
+    import orjson
+except ImportError:  # 未安裝 orjson 時退回 Flask 預設的編碼器
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, date):
+        return http_date(value)
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if hasattr(value, "__html__"):
+        return str(value.__html__())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """Flask JSON provider：編碼用 orjson，直接產生 bytes 給回應使用。"""
+
+    def _options(self):
+        options = (
+            orjson.OPT_PASSTHROUGH_DATETIME
+            | orjson.OPT_PASSTHROUGH_DATACLASS
+            | orjson.OPT_NON_STR_KEYS
+        )
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        if self.compact is False or (self.compact is None and self._app.debug):
+            options |= orjson.OPT_INDENT_2
+        return options
+
+    def dumps_bytes(self, obj):
+        return orjson.dumps(obj, default=_default, option=self._options())
+
+    def dumps(self, obj, **kwargs):
+        if kwargs:
+            # 有指定 json.dumps 參數 (例如 indent) 時交給預設實作
+            return super().dumps(obj, **kwargs)
+        return self.dumps_bytes(obj).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = self.dumps_bytes(obj)
+        if self.compact is False or (self.compact is None and self._app.debug):
+            body += b"\n"
+        return self._app.response_class(body, mimetype=self.mimetype)
+
+
+JSON_PROVIDERS = {
+    "default": DefaultJSONProvider,
+    "orjson": OrjsonProvider,
+}
+
+
+def install(app, name=None):
+    """依名稱 (JSON_PROVIDER 設定) 安裝 JSON provider；orjson 不可用時使用預設。"""
+    name = (name or "orjson").lower()
+    if name not in JSON_PROVIDERS:
+        raise ValueError(f"未知的 JSON_PROVIDER: {name}")
+    if name == "orjson" and orjson is None:
+        name = "default"
+    app.json = JSON_PROVIDERS[name](app)
+    return name
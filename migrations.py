@@ -0,0 +1,369 @@
+# migrations.py
+# 資料庫結構版本管理：依版本號依序套用 DDL，並記錄在 CC_SCHEMA_VERSION。
+# 另提供索引檢查，列出熱門查詢缺少的索引與套用前後的估計執行計畫差異。
+
+import logging
+import xml.etree.ElementTree as ET
+
+SCHEMA_TABLE = "CC_SCHEMA_VERSION"
+SHOWPLAN_NS = {"p": "http://schemas.microsoft.com/sqlserver/2004/07/showplan"}
+
+# ===============================================
+# 版本化 DDL
+# ===============================================
+# 所有語法都以 IF NOT EXISTS 保護，既有資料庫 (表格早已建立) 也能安全套用。
+MIGRATIONS = [
+    (1, "create_tables", [
+        """
+        IF OBJECT_ID(N'dbo.CC_USER', N'U') IS NULL
+        CREATE TABLE dbo.CC_USER (
+            USER_NAME NVARCHAR(50) NOT NULL CONSTRAINT PK_CC_USER PRIMARY KEY,
+            PASSWORD NVARCHAR(255) NOT NULL
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.CC_MASTER', N'U') IS NULL
+        CREATE TABLE dbo.CC_MASTER (
+            CCM_ID NVARCHAR(50) NOT NULL CONSTRAINT PK_CC_MASTER PRIMARY KEY,
+            CC_SIZE NVARCHAR(50) NULL,
+            BOX_ID NVARCHAR(50) NULL,
+            USER_NAME NVARCHAR(50) NULL,
+            CC_STARTTIME DATETIME NULL,
+            UPD_CNT INT NULL CONSTRAINT DF_CC_MASTER_UPD_CNT DEFAULT 0
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.CC_LOG', N'U') IS NULL
+        CREATE TABLE dbo.CC_LOG (
+            CCL_ID INT IDENTITY(1, 1) NOT NULL CONSTRAINT PK_CC_LOG PRIMARY KEY,
+            CC_ID_FK NVARCHAR(50) NOT NULL
+                CONSTRAINT FK_CC_LOG_CC_MASTER REFERENCES dbo.CC_MASTER (CCM_ID) ON DELETE CASCADE,
+            INPUT_DATE DATETIME NULL,
+            CC_STATUS NVARCHAR(50) NULL,
+            CC_SUBSTATUS NVARCHAR(50) NULL,
+            UPDATE_BY NVARCHAR(50) NULL,
+            UPDATE_TIME DATETIME NULL,
+            COMMENT NVARCHAR(500) NULL
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.CC_REPORT', N'U') IS NULL
+        CREATE TABLE dbo.CC_REPORT (
+            ID INT IDENTITY(1, 1) NOT NULL CONSTRAINT PK_CC_REPORT PRIMARY KEY,
+            CCM_ID_FK NVARCHAR(50) NOT NULL
+                CONSTRAINT FK_CC_REPORT_CC_MASTER REFERENCES dbo.CC_MASTER (CCM_ID) ON DELETE CASCADE,
+            REPORTER NVARCHAR(50) NULL,
+            REPORT_TIME DATETIME NULL,
+            ISSUE_TYPE NVARCHAR(50) NULL,
+            ISSUE_INFO NVARCHAR(MAX) NULL,
+            IMAGE_PATH NVARCHAR(MAX) NULL,
+            STATUS NVARCHAR(20) NULL,
+            PROCESSER NVARCHAR(50) NULL,
+            PROCESS_TIME DATETIME NULL,
+            PROCESS_NOTES NVARCHAR(MAX) NULL
+        )
+        """,
+    ]),
+    (2, "hot_query_indexes", [
+        # get_equipment_data：每個器材取 MAX(CCL_ID) 的那一筆，INCLUDE 列表需要的欄位避免回查
+        """
+        IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_CC_LOG_CC_ID_FK_CCL_ID' AND object_id = OBJECT_ID(N'dbo.CC_LOG'))
+        CREATE NONCLUSTERED INDEX IX_CC_LOG_CC_ID_FK_CCL_ID
+            ON dbo.CC_LOG (CC_ID_FK, CCL_ID DESC)
+            INCLUDE (CC_STATUS, CC_SUBSTATUS, UPDATE_BY, UPDATE_TIME, COMMENT)
+        """,
+        # get_status_counts / get_log_history：每個器材依 UPDATE_TIME 取最新一筆與排序
+        """
+        IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_CC_LOG_CC_ID_FK_UPDATE_TIME' AND object_id = OBJECT_ID(N'dbo.CC_LOG'))
+        CREATE NONCLUSTERED INDEX IX_CC_LOG_CC_ID_FK_UPDATE_TIME
+            ON dbo.CC_LOG (CC_ID_FK, UPDATE_TIME DESC)
+            INCLUDE (CC_STATUS)
+        """,
+        # get_all_reports：依 REPORT_TIME 由新到舊列出全部欄位
+        """
+        IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_CC_REPORT_REPORT_TIME' AND object_id = OBJECT_ID(N'dbo.CC_REPORT'))
+        CREATE NONCLUSTERED INDEX IX_CC_REPORT_REPORT_TIME
+            ON dbo.CC_REPORT (REPORT_TIME DESC)
+            INCLUDE (CCM_ID_FK, REPORTER, ISSUE_TYPE, ISSUE_INFO, IMAGE_PATH, STATUS, PROCESSER, PROCESS_TIME, PROCESS_NOTES)
+        """,
+        # 登入與帳號檢查：舊資料庫的 USER_NAME 不一定是主鍵
+        """
+        IF NOT EXISTS (
+            SELECT 1 FROM sys.index_columns ic
+            JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+            WHERE ic.object_id = OBJECT_ID(N'dbo.CC_USER') AND ic.key_ordinal = 1 AND c.name = N'USER_NAME'
+        )
+        CREATE UNIQUE NONCLUSTERED INDEX UX_CC_USER_USER_NAME
+            ON dbo.CC_USER (USER_NAME)
+            INCLUDE (PASSWORD)
+        """,
+    ]),
+    (3, "rollup_tables", [
+        """
+        IF OBJECT_ID(N'dbo.CC_STATUS_CURRENT', N'U') IS NULL
+        CREATE TABLE dbo.CC_STATUS_CURRENT (
+            CCM_ID NVARCHAR(50) NOT NULL CONSTRAINT PK_CC_STATUS_CURRENT PRIMARY KEY,
+            CC_STATUS NVARCHAR(50) NOT NULL,
+            SINCE DATETIME NULL,
+            LAST_CCL_ID INT NOT NULL
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.CC_STATUS_DAILY', N'U') IS NULL
+        CREATE TABLE dbo.CC_STATUS_DAILY (
+            STAT_DATE DATE NOT NULL,
+            CC_STATUS NVARCHAR(50) NOT NULL,
+            ITEM_COUNT INT NOT NULL,
+            ENTERED INT NOT NULL DEFAULT 0,
+            EXITED INT NOT NULL DEFAULT 0,
+            CONSTRAINT PK_CC_STATUS_DAILY PRIMARY KEY (STAT_DATE, CC_STATUS)
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.CC_STATUS_DURATION', N'U') IS NULL
+        CREATE TABLE dbo.CC_STATUS_DURATION (
+            CC_STATUS NVARCHAR(50) NOT NULL CONSTRAINT PK_CC_STATUS_DURATION PRIMARY KEY,
+            TOTAL_SECONDS BIGINT NOT NULL,
+            INTERVALS INT NOT NULL
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.CC_REPORT_TURNAROUND', N'U') IS NULL
+        CREATE TABLE dbo.CC_REPORT_TURNAROUND (
+            ISSUE_TYPE NVARCHAR(50) NOT NULL CONSTRAINT PK_CC_REPORT_TURNAROUND PRIMARY KEY,
+            COMPLETED INT NOT NULL,
+            TOTAL_SECONDS BIGINT NOT NULL
+        )
+        """,
+        """
+        IF OBJECT_ID(N'dbo.CC_ROLLUP_WATERMARK', N'U') IS NULL
+        CREATE TABLE dbo.CC_ROLLUP_WATERMARK (
+            NAME NVARCHAR(50) NOT NULL CONSTRAINT PK_CC_ROLLUP_WATERMARK PRIMARY KEY,
+            LAST_ID INT NOT NULL,
+            UPDATED_AT DATETIME NOT NULL
+        )
+        """,
+    ]),
+    # 帳號快取 (user_cache.py) 依 CREATED_AT 遞增載入新註冊的帳號；既有帳號維持 NULL
+    (4, "user_created_at", [
+        """
+        IF COL_LENGTH(N'dbo.CC_USER', N'CREATED_AT') IS NULL
+        ALTER TABLE dbo.CC_USER ADD CREATED_AT DATETIME NULL
+            CONSTRAINT DF_CC_USER_CREATED_AT DEFAULT GETDATE()
+        """,
+        """
+        IF NOT EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_CC_USER_CREATED_AT' AND object_id = OBJECT_ID(N'dbo.CC_USER'))
+        CREATE NONCLUSTERED INDEX IX_CC_USER_CREATED_AT
+            ON dbo.CC_USER (CREATED_AT)
+            INCLUDE (USER_NAME)
+        """,
+    ]),
+    # get_log_history 是 SELECT * 並依 UPDATE_TIME DESC, CCL_ID DESC 排序：
+    # 索引鍵與排序一致並 INCLUDE 其餘欄位，免去每一筆的 key lookup 與排序
+    (5, "log_history_covering_index", [
+        """
+        IF EXISTS (SELECT 1 FROM sys.indexes WHERE name = N'IX_CC_LOG_CC_ID_FK_UPDATE_TIME' AND object_id = OBJECT_ID(N'dbo.CC_LOG'))
+        CREATE NONCLUSTERED INDEX IX_CC_LOG_CC_ID_FK_UPDATE_TIME
+            ON dbo.CC_LOG (CC_ID_FK, UPDATE_TIME DESC, CCL_ID DESC)
+            INCLUDE (INPUT_DATE, CC_STATUS, CC_SUBSTATUS, UPDATE_BY, COMMENT)
+            WITH (DROP_EXISTING = ON)
+        ELSE
+        CREATE NONCLUSTERED INDEX IX_CC_LOG_CC_ID_FK_UPDATE_TIME
+            ON dbo.CC_LOG (CC_ID_FK, UPDATE_TIME DESC, CCL_ID DESC)
+            INCLUDE (INPUT_DATE, CC_STATUS, CC_SUBSTATUS, UPDATE_BY, COMMENT)
+        """,
+    ]),
+]
+
+# 熱門查詢需要的索引：(表格, 索引鍵欄位前綴, 說明)
+REQUIRED_INDEXES = [
+    ("CC_LOG", ("CC_ID_FK", "CCL_ID"), "get_equipment_data 最新日誌"),
+    ("CC_LOG", ("CC_ID_FK", "UPDATE_TIME", "CCL_ID"), "get_status_counts / get_log_history"),
+    ("CC_REPORT", ("REPORT_TIME",), "get_all_reports 排序"),
+    ("CC_USER", ("USER_NAME",), "登入與帳號檢查"),
+]
+
+# 用於比較執行計畫的熱門查詢 (以區域變數代替參數，SHOWPLAN 不會實際執行)
+HOT_QUERIES = {
+    "get_equipment_data": """
+        SELECT M.CCM_ID, M.CC_SIZE, M.BOX_ID, M.USER_NAME, M.CC_STARTTIME, M.UPD_CNT,
+               L.CC_STATUS, L.CC_SUBSTATUS, L.COMMENT, L.UPDATE_BY, L.UPDATE_TIME
+        FROM CC_MASTER M
+        LEFT JOIN CC_LOG L ON M.CCM_ID = L.CC_ID_FK
+        WHERE L.CCL_ID = (SELECT MAX(CCL_ID) FROM CC_LOG WHERE CC_ID_FK = M.CCM_ID)
+           OR L.CCL_ID IS NULL
+        ORDER BY M.CCM_ID
+    """,
+    "get_status_counts": """
+        SELECT T1.CC_STATUS, COUNT(T1.CC_STATUS) AS count
+        FROM CC_LOG AS T1
+        JOIN (
+            SELECT CC_ID_FK, MAX(UPDATE_TIME) AS MaxDateTime
+            FROM CC_LOG
+            GROUP BY CC_ID_FK
+        ) AS T2 ON T1.CC_ID_FK = T2.CC_ID_FK AND T1.UPDATE_TIME = T2.MaxDateTime
+        GROUP BY T1.CC_STATUS
+    """,
+    "get_log_history": """
+        DECLARE @ccm_id NVARCHAR(50) = N'';
+        SELECT * FROM CC_LOG WHERE CC_ID_FK = @ccm_id ORDER BY UPDATE_TIME DESC, CCL_ID DESC
+    """,
+    "get_all_reports": """
+        SELECT ID, CCM_ID_FK, REPORTER, REPORT_TIME, ISSUE_TYPE, ISSUE_INFO, IMAGE_PATH,
+               STATUS, PROCESSER, PROCESS_TIME, PROCESS_NOTES
+        FROM CC_REPORT ORDER BY REPORT_TIME DESC
+    """,
+    "login": """
+        DECLARE @username NVARCHAR(50) = N'';
+        SELECT PASSWORD FROM CC_USER WHERE USER_NAME = @username
+    """,
+}
+
+
+# ===============================================
+# 套用版本
+# ===============================================
+def _ensure_schema_table(cursor):
+    cursor.execute(f"""
+        IF OBJECT_ID(N'dbo.{SCHEMA_TABLE}', N'U') IS NULL
+        CREATE TABLE dbo.{SCHEMA_TABLE} (
+            VERSION INT NOT NULL PRIMARY KEY,
+            NAME NVARCHAR(100) NOT NULL,
+            APPLIED_AT DATETIME NOT NULL DEFAULT GETDATE()
+        )
+    """)
+
+
+def applied_versions(conn, create=True):
+    """已套用的版本號；create=False 時不建立版本表 (唯讀檢查用)。"""
+    cursor = conn.cursor()
+    if create:
+        _ensure_schema_table(cursor)
+        conn.commit()
+    else:
+        cursor.execute(f"SELECT OBJECT_ID(N'dbo.{SCHEMA_TABLE}', N'U')")
+        if cursor.fetchone()[0] is None:
+            return set()
+    cursor.execute(f"SELECT VERSION FROM dbo.{SCHEMA_TABLE}")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def pending_migrations(conn, create=True):
+    applied = applied_versions(conn, create)
+    return [m for m in MIGRATIONS if m[0] not in applied]
+
+
+def migrate(conn, target=None):
+    """依序套用尚未執行的版本 (每個版本一個交易)，回傳套用的 (版本, 名稱) 列表。"""
+    done = []
+    cursor = conn.cursor()
+    for version, name, statements in pending_migrations(conn):
+        if target is not None and version > target:
+            break
+        try:
+            for statement in statements:
+                cursor.execute(statement)
+            cursor.execute(
+                f"INSERT INTO dbo.{SCHEMA_TABLE} (VERSION, NAME) VALUES (?, ?)",
+                version, name
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logging.error(f"套用資料庫版本 {version} ({name}) 失敗")
+            raise
+        logging.info(f"已套用資料庫版本 {version} ({name})")
+        done.append((version, name))
+    return done
+
+
+# ===============================================
+# 索引檢查
+# ===============================================
+def _index_key_columns(cursor, table):
+    """回傳 {索引名稱: (索引鍵欄位, ...)}，依 key_ordinal 排序。"""
+    cursor.execute("""
+        SELECT i.name, c.name
+        FROM sys.indexes i
+        JOIN sys.index_columns ic ON ic.object_id = i.object_id AND ic.index_id = i.index_id
+        JOIN sys.columns c ON c.object_id = ic.object_id AND c.column_id = ic.column_id
+        WHERE i.object_id = OBJECT_ID(?) AND ic.is_included_column = 0
+        ORDER BY i.name, ic.key_ordinal
+    """, f"dbo.{table}")
+    indexes = {}
+    for index_name, column_name in cursor.fetchall():
+        indexes.setdefault(index_name, []).append(column_name.upper())
+    return {name: tuple(columns) for name, columns in indexes.items()}
+
+
+def missing_indexes(conn):
+    """回傳 REQUIRED_INDEXES 中，沒有任何索引以這些欄位為開頭的項目。"""
+    cursor = conn.cursor()
+    cache = {}
+    missing = []
+    for table, columns, purpose in REQUIRED_INDEXES:
+        if table not in cache:
+            cache[table] = _index_key_columns(cursor, table)
+        covered = any(keys[:len(columns)] == columns for keys in cache[table].values())
+        if not covered:
+            missing.append((table, columns, purpose))
+    return missing
+
+
+def _plan_summary(plan_xml):
+    """從 SHOWPLAN XML 取出總估計成本與存取 CC_* 表格的運算子。"""
+    root = ET.fromstring(plan_xml)
+    cost = 0.0
+    for stmt in root.iterfind(".//p:StmtSimple", SHOWPLAN_NS):
+        cost += float(stmt.get("StatementSubTreeCost", 0) or 0)
+    operators = []
+    for relop in root.iterfind(".//p:RelOp", SHOWPLAN_NS):
+        obj = relop.find("./*/p:Object", SHOWPLAN_NS)
+        if obj is None or "CC_" not in (obj.get("Table") or ""):
+            continue
+        label = f"{relop.get('PhysicalOp')} {obj.get('Table')}"
+        if obj.get("Index"):
+            label += f".{obj.get('Index')}"
+        operators.append(label.replace("[", "").replace("]", ""))
+    return {"cost": cost, "operators": operators}
+
+
+def query_plans(conn):
+    """取得 HOT_QUERIES 的估計執行計畫摘要：{查詢名稱: {"cost", "operators"}}。"""
+    cursor = conn.cursor()
+    plans = {}
+    cursor.execute("SET SHOWPLAN_XML ON")
+    try:
+        for name, sql in HOT_QUERIES.items():
+            cursor.execute(sql)
+            xml_parts = []
+            while True:
+                row = cursor.fetchone()
+                if row is not None:
+                    xml_parts.append(row[0])
+                if not cursor.nextset():
+                    break
+            plans[name] = _plan_summary(xml_parts[-1]) if xml_parts else None
+    finally:
+        cursor.execute("SET SHOWPLAN_XML OFF")
+    return plans
+
+
+def format_plan_diff(before, after=None):
+    """把兩份 query_plans() 的結果排成文字報表；沒有 after 時只列出目前的執行計畫。"""
+    lines = []
+    for name in HOT_QUERIES:
+        old = before.get(name)
+        new = after.get(name) if after is not None else None
+        if old is None or (after is not None and new is None):
+            lines.append(f"{name}: 無法取得執行計畫")
+            continue
+        if after is None:
+            lines.append(f"{name}: 估計成本 {old['cost']:.4f}")
+            lines.append(f"    {', '.join(old['operators'])}")
+            continue
+        lines.append(f"{name}: 估計成本 {old['cost']:.4f} -> {new['cost']:.4f}")
+        if old["operators"] != new["operators"]:
+            lines.append(f"    之前: {', '.join(old['operators'])}")
+            lines.append(f"    之後: {', '.join(new['operators'])}")
+    return "\n".join(lines)
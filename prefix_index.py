@@ -0,0 +1,170 @@
+# prefix_index.py
+# CCM_ID / BOX_ID / USER_NAME 的記憶體前綴索引 (排序陣列 + bisect)，供搜尋與自動完成使用。
+# 由器材的寫入 API 即時更新；每個 worker 各自有一份，超過 ttl 秒會重新從資料庫載入，
+# 其他 worker 的寫入最晚在 ttl 秒後可見。
+
+import logging
+import threading
+import time
+from bisect import bisect_left, insort
+
+FIELDS = ("CCM_ID", "BOX_ID", "USER_NAME")
+DEFAULT_TTL = 60
+
+
+class _SortedField:
+    """
+    依不分大小寫排序的 (KEY, 原值) 陣列，加上每個值被器材引用的次數。
+    pinned 的值 (已註冊的帳號) 沒有器材引用時也保留在索引中，次數為 0。
+    """
+
+    def __init__(self, values=(), pinned=()):
+        self.counts = {}
+        for value in values:
+            if value:
+                self.counts[value] = self.counts.get(value, 0) + 1
+        self.pinned = {value for value in pinned if value}
+        self.entries = sorted((value.upper(), value) for value in self.pinned.union(self.counts))
+
+    def add(self, value):
+        if not value:
+            return
+        count = self.counts.get(value, 0)
+        self.counts[value] = count + 1
+        if count == 0 and value not in self.pinned:
+            insort(self.entries, (value.upper(), value))
+
+    def pin(self, value):
+        if not value or value in self.pinned:
+            return
+        self.pinned.add(value)
+        if value not in self.counts:
+            insort(self.entries, (value.upper(), value))
+
+    def remove(self, value):
+        count = self.counts.get(value, 0)
+        if count == 0:
+            return
+        if count > 1:
+            self.counts[value] = count - 1
+            return
+        del self.counts[value]
+        if value in self.pinned:
+            return
+        entry = (value.upper(), value)
+        i = bisect_left(self.entries, entry)
+        if i < len(self.entries) and self.entries[i] == entry:
+            del self.entries[i]
+
+    def search(self, prefix, limit):
+        prefix = prefix.upper()
+        i = bisect_left(self.entries, (prefix,))
+        result = []
+        while i < len(self.entries) and len(result) < limit:
+            key, value = self.entries[i]
+            if not key.startswith(prefix):
+                break
+            result.append({"value": value, "count": self.counts.get(value, 0)})
+            i += 1
+        return result
+
+
+class PrefixIndex:
+    def __init__(self, ttl=DEFAULT_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._fields = {field: _SortedField() for field in FIELDS}
+        self._items = {}
+        self._loaded_at = None
+
+    def load(self, cursor):
+        """從資料庫重新建立索引 (一次查詢 CC_MASTER 三個欄位與 CC_USER 名稱)。"""
+        cursor.execute("SELECT CCM_ID, BOX_ID, USER_NAME FROM CC_MASTER")
+        items = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+        cursor.execute("SELECT USER_NAME FROM CC_USER")
+        users = [row[0] for row in cursor.fetchall()]
+
+        fields = {
+            "CCM_ID": _SortedField(items),
+            "BOX_ID": _SortedField(box for box, _user in items.values()),
+            "USER_NAME": _SortedField((user for _box, user in items.values()), pinned=users),
+        }
+        with self._lock:
+            self._fields = fields
+            self._items = items
+            self._loaded_at = time.monotonic()
+
+    def is_stale(self):
+        return self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl
+
+    def refresh(self, connect):
+        """
+        超過 ttl 時重新載入 (connect() 回傳新的資料庫連線，用完即關閉)。
+        第一次載入在呼叫端執行；之後在背景執行緒載入，搜尋請求不等待，
+        先用目前的內容 (寫入路徑本來就會即時更新索引)。同一時間只有一個載入在進行。
+        """
+        if not self.is_stale():
+            return
+        first = self._loaded_at is None
+        if not self._refresh_lock.acquire(blocking=first):
+            return
+        if first:
+            try:
+                if self.is_stale():
+                    self._load_from(connect)
+            finally:
+                self._refresh_lock.release()
+            return
+        threading.Thread(target=self._background_load, args=(connect,), name="search-index-reload", daemon=True).start()
+
+    def _load_from(self, connect):
+        conn = connect()
+        try:
+            self.load(conn.cursor())
+        finally:
+            conn.close()
+
+    def _background_load(self, connect):
+        try:
+            self._load_from(connect)
+            logging.debug("已在背景重新載入搜尋索引")
+        except Exception as e:
+            logging.error(f"背景重新載入搜尋索引失敗: {e}")
+        finally:
+            self._refresh_lock.release()
+
+    def search(self, prefix, fields=FIELDS, limit=20):
+        with self._lock:
+            return {field: self._fields[field].search(prefix, limit) for field in fields}
+
+    # ===============================================
+    # 寫入時更新
+    # ===============================================
+    def put_item(self, ccm_id, box_id, user_name):
+        """新增或更新一個器材 (CCM_ID 已存在時先移除舊的 BOX_ID / USER_NAME)。"""
+        if not ccm_id:
+            return
+        with self._lock:
+            old = self._items.get(ccm_id)
+            if old is not None:
+                self._fields["BOX_ID"].remove(old[0])
+                self._fields["USER_NAME"].remove(old[1])
+            else:
+                self._fields["CCM_ID"].add(ccm_id)
+            self._items[ccm_id] = (box_id, user_name)
+            self._fields["BOX_ID"].add(box_id)
+            self._fields["USER_NAME"].add(user_name)
+
+    def remove_item(self, ccm_id):
+        with self._lock:
+            old = self._items.pop(ccm_id, None)
+            if old is None:
+                return
+            self._fields["CCM_ID"].remove(ccm_id)
+            self._fields["BOX_ID"].remove(old[0])
+            self._fields["USER_NAME"].remove(old[1])
+
+    def add_user(self, user_name):
+        with self._lock:
+            self._fields["USER_NAME"].pin(user_name)
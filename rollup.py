@@ -0,0 +1,404 @@
+# rollup.py
+# 狀態與回報的統計彙總表，以遞增方式維護，分析 API 只讀取這些小表格，
+# 回應時間不會隨 CC_LOG / CC_REPORT 的歷史筆數增加。
+#
+#   CC_STATUS_CURRENT    每個器材目前的狀態與開始時間
+#   CC_STATUS_DAILY      每天每個狀態的器材數 (當天結束時) 與進入/離開次數
+#   CC_STATUS_DURATION   每個狀態已結束區間的累計秒數
+#   CC_REPORT_TURNAROUND 每個問題類型已完成回報的處理時間 (REPORT_TIME 到 PROCESS_TIME)
+#   CC_ROLLUP_WATERMARK  已處理到的 CCL_ID / 回報彙總是否已初始化
+#
+# CC_LOG 由 refresh() 依 watermark 分批處理 (背景執行或 flask rollup-refresh)；
+# 回報在 update_report / delete_report 的交易中直接更新。
+# refresh() 以 sp_getapplock (session 層級) 互斥，多個 worker 同時執行也不會重複計算。
+
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime
+
+LOG_WATERMARK = "cc_log"
+REPORT_WATERMARK = "report_turnaround"
+REPORT_DONE_STATUS = "已完成"
+APPLOCK_NAME = "cc_rollup_refresh"
+BATCH_SIZE = 10000
+
+ROLLUP_TABLES = [
+    "CC_STATUS_CURRENT", "CC_STATUS_DAILY", "CC_STATUS_DURATION",
+    "CC_REPORT_TURNAROUND", "CC_ROLLUP_WATERMARK",
+]
+
+MERGE_CURRENT_SQL = """
+    MERGE CC_STATUS_CURRENT AS T
+    USING (SELECT ? AS CCM_ID, ? AS CC_STATUS, ? AS SINCE, ? AS LAST_CCL_ID) AS S
+    ON T.CCM_ID = S.CCM_ID
+    WHEN MATCHED THEN UPDATE SET CC_STATUS = S.CC_STATUS, SINCE = S.SINCE, LAST_CCL_ID = S.LAST_CCL_ID
+    WHEN NOT MATCHED THEN INSERT (CCM_ID, CC_STATUS, SINCE, LAST_CCL_ID)
+        VALUES (S.CCM_ID, S.CC_STATUS, S.SINCE, S.LAST_CCL_ID);
+"""
+MERGE_DURATION_SQL = """
+    MERGE CC_STATUS_DURATION AS T
+    USING (SELECT ? AS CC_STATUS, ? AS SECONDS, ? AS INTERVALS) AS S
+    ON T.CC_STATUS = S.CC_STATUS
+    WHEN MATCHED THEN UPDATE SET TOTAL_SECONDS = T.TOTAL_SECONDS + S.SECONDS, INTERVALS = T.INTERVALS + S.INTERVALS
+    WHEN NOT MATCHED THEN INSERT (CC_STATUS, TOTAL_SECONDS, INTERVALS) VALUES (S.CC_STATUS, S.SECONDS, S.INTERVALS);
+"""
+MERGE_DAILY_SQL = """
+    MERGE CC_STATUS_DAILY AS T
+    USING (SELECT ? AS STAT_DATE, ? AS CC_STATUS, ? AS ITEM_COUNT, ? AS ENTERED, ? AS EXITED) AS S
+    ON T.STAT_DATE = S.STAT_DATE AND T.CC_STATUS = S.CC_STATUS
+    WHEN MATCHED THEN UPDATE SET ITEM_COUNT = S.ITEM_COUNT,
+        ENTERED = T.ENTERED + S.ENTERED, EXITED = T.EXITED + S.EXITED
+    WHEN NOT MATCHED THEN INSERT (STAT_DATE, CC_STATUS, ITEM_COUNT, ENTERED, EXITED)
+        VALUES (S.STAT_DATE, S.CC_STATUS, S.ITEM_COUNT, S.ENTERED, S.EXITED);
+"""
+MERGE_TURNAROUND_SQL = """
+    MERGE CC_REPORT_TURNAROUND AS T
+    USING (SELECT ? AS ISSUE_TYPE, ? AS COMPLETED, ? AS SECONDS) AS S
+    ON T.ISSUE_TYPE = S.ISSUE_TYPE
+    WHEN MATCHED THEN UPDATE SET COMPLETED = T.COMPLETED + S.COMPLETED, TOTAL_SECONDS = T.TOTAL_SECONDS + S.SECONDS
+    WHEN NOT MATCHED THEN INSERT (ISSUE_TYPE, COMPLETED, TOTAL_SECONDS) VALUES (S.ISSUE_TYPE, S.COMPLETED, S.SECONDS);
+"""
+
+
+def _status_key(status):
+    # 主鍵不能是 NULL，未設定狀態的日誌以空字串統計
+    return status or ""
+
+
+def _get_watermark(cursor, name):
+    cursor.execute("SELECT LAST_ID FROM CC_ROLLUP_WATERMARK WHERE NAME = ?", name)
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _set_watermark(cursor, name, last_id):
+    cursor.execute("""
+        MERGE CC_ROLLUP_WATERMARK AS T
+        USING (SELECT ? AS NAME, ? AS LAST_ID) AS S ON T.NAME = S.NAME
+        WHEN MATCHED THEN UPDATE SET LAST_ID = S.LAST_ID, UPDATED_AT = GETDATE()
+        WHEN NOT MATCHED THEN INSERT (NAME, LAST_ID, UPDATED_AT) VALUES (S.NAME, S.LAST_ID, GETDATE());
+    """, name, last_id)
+
+
+def _tables_ready(cursor):
+    """彙總表是否已建立 (migration v3)；尚未建立時寫入路徑的 hook 直接略過。"""
+    cursor.execute("SELECT OBJECT_ID(N'dbo.CC_ROLLUP_WATERMARK', N'U')")
+    return cursor.fetchone()[0] is not None
+
+
+@contextmanager
+def _refresh_lock(conn):
+    """以 session 層級的 applock 互斥；拿不到鎖 (其他 worker 正在執行) 時回傳 False。"""
+    cursor = conn.cursor()
+    cursor.execute("""
+        SET NOCOUNT ON;
+        DECLARE @result INT;
+        EXEC @result = sp_getapplock @Resource = ?, @LockMode = 'Exclusive', @LockOwner = 'Session', @LockTimeout = 0;
+        SELECT @result;
+    """, APPLOCK_NAME)
+    acquired = cursor.fetchone()[0] >= 0
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            cursor.execute("EXEC sp_releaseapplock @Resource = ?, @LockOwner = 'Session'", APPLOCK_NAME)
+
+
+# ===============================================
+# CC_LOG 狀態彙總
+# ===============================================
+def _apply_log_batch(cursor, logs):
+    """把一批依 CCL_ID 排序的日誌套用到彙總表。"""
+    ids = list({log[1] for log in logs})
+    cursor.execute(
+        "SELECT CCM_ID, CC_STATUS, SINCE, LAST_CCL_ID FROM CC_STATUS_CURRENT "
+        "WHERE CCM_ID IN (SELECT value FROM OPENJSON(?))",
+        json.dumps(ids)
+    )
+    current = {row[0]: [row[1], row[2], row[3]] for row in cursor.fetchall()}
+
+    cursor.execute("SELECT CC_STATUS, COUNT(*) FROM CC_STATUS_CURRENT GROUP BY CC_STATUS")
+    running = defaultdict(int, {row[0]: row[1] for row in cursor.fetchall()})
+
+    durations = defaultdict(lambda: [0, 0])
+    transitions = defaultdict(lambda: [0, 0])  # (日期, 狀態) -> [進入, 離開]
+    snapshots = {}
+    changed = set()
+
+    for ccl_id, ccm_id, status, update_time in logs:
+        status = _status_key(status)
+        update_time = update_time or datetime.now()
+        day = update_time.date()
+        state = current.get(ccm_id)
+        if state is None:
+            current[ccm_id] = [status, update_time, ccl_id]
+            running[status] += 1
+            transitions[(day, status)][0] += 1
+        elif state[0] != status:
+            old_status, since = state[0], state[1]
+            seconds = max(int((update_time - since).total_seconds()), 0) if since else 0
+            durations[old_status][0] += seconds
+            durations[old_status][1] += 1
+            running[old_status] -= 1
+            running[status] += 1
+            transitions[(day, old_status)][1] += 1
+            transitions[(day, status)][0] += 1
+            current[ccm_id] = [status, update_time, ccl_id]
+        else:
+            state[2] = ccl_id
+        changed.add(ccm_id)
+        # 依處理順序記下每天結束時的各狀態數量
+        snapshots[day] = dict(running)
+
+    cursor.fast_executemany = True
+    cursor.executemany(MERGE_CURRENT_SQL, [
+        (ccm_id, *current[ccm_id]) for ccm_id in changed
+    ])
+    if durations:
+        cursor.executemany(MERGE_DURATION_SQL, [
+            (status, seconds, intervals) for status, (seconds, intervals) in durations.items()
+        ])
+    daily_rows = []
+    for day, counts in snapshots.items():
+        for status, count in counts.items():
+            entered, exited = transitions.get((day, status), (0, 0))
+            daily_rows.append((day, status, count, entered, exited))
+    if daily_rows:
+        cursor.executemany(MERGE_DAILY_SQL, daily_rows)
+
+
+def refresh_status(conn, batch_size=BATCH_SIZE):
+    """處理 watermark 之後的新日誌，每批一個交易。回傳處理的筆數。"""
+    cursor = conn.cursor()
+    processed = 0
+    while True:
+        try:
+            last_id = _get_watermark(cursor, LOG_WATERMARK) or 0
+            cursor.execute(
+                "SELECT TOP (?) CCL_ID, CC_ID_FK, CC_STATUS, UPDATE_TIME FROM CC_LOG WHERE CCL_ID > ? ORDER BY CCL_ID",
+                batch_size, last_id
+            )
+            logs = [tuple(row) for row in cursor.fetchall()]
+            if not logs:
+                conn.rollback()
+                return processed
+            _apply_log_batch(cursor, logs)
+            _set_watermark(cursor, LOG_WATERMARK, logs[-1][0])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        processed += len(logs)
+        if len(logs) < batch_size:
+            return processed
+
+
+def snapshot_today(cursor):
+    """以 CC_STATUS_CURRENT 重新寫入今天的各狀態器材數 (刪除器材後使用)。"""
+    cursor.execute("""
+        MERGE CC_STATUS_DAILY AS T
+        USING (
+            SELECT CAST(GETDATE() AS DATE) AS STAT_DATE, S.CC_STATUS, COUNT(C.CCM_ID) AS ITEM_COUNT
+            FROM (SELECT CC_STATUS FROM CC_STATUS_CURRENT UNION SELECT CC_STATUS FROM CC_STATUS_DURATION) S
+            LEFT JOIN CC_STATUS_CURRENT C ON C.CC_STATUS = S.CC_STATUS
+            GROUP BY S.CC_STATUS
+        ) AS S
+        ON T.STAT_DATE = S.STAT_DATE AND T.CC_STATUS = S.CC_STATUS
+        WHEN MATCHED THEN UPDATE SET ITEM_COUNT = S.ITEM_COUNT
+        WHEN NOT MATCHED THEN INSERT (STAT_DATE, CC_STATUS, ITEM_COUNT, ENTERED, EXITED)
+            VALUES (S.STAT_DATE, S.CC_STATUS, S.ITEM_COUNT, 0, 0);
+    """)
+
+
+def forget_item(cursor, ccm_id):
+    """
+    刪除器材時呼叫 (與刪除同一個交易)：結束目前狀態的區間並從目前狀態表移除。
+    失敗時例外會往外拋，由呼叫端回滾整個刪除，避免彙總只更新一半。
+    """
+    if not _tables_ready(cursor):
+        return
+    cursor.execute("SELECT CC_STATUS, SINCE FROM CC_STATUS_CURRENT WHERE CCM_ID = ?", ccm_id)
+    row = cursor.fetchone()
+    if row is None:
+        return
+    seconds = max(int((datetime.now() - row[1]).total_seconds()), 0) if row[1] else 0
+    cursor.execute(MERGE_DURATION_SQL, row[0], seconds, 1)
+    cursor.execute("DELETE FROM CC_STATUS_CURRENT WHERE CCM_ID = ?", ccm_id)
+    cursor.execute(MERGE_DAILY_SQL, date.today(), row[0], 0, 0, 1)
+    snapshot_today(cursor)
+
+
+# ===============================================
+# 回報處理時間彙總
+# ===============================================
+def report_state(cursor, report_id):
+    """讀取回報目前的狀態，供 apply_report_change 比較前後差異。"""
+    cursor.execute("""
+        SELECT STATUS, ISSUE_TYPE, DATEDIFF_BIG(SECOND, REPORT_TIME, PROCESS_TIME)
+        FROM CC_REPORT WHERE ID = ?
+    """, report_id)
+    row = cursor.fetchone()
+    return tuple(row) if row else None
+
+
+def apply_report_change(cursor, old_state, new_state):
+    """
+    依回報更新前後的狀態調整 CC_REPORT_TURNAROUND (與更新同一個交易)。
+    失敗時例外會往外拋，由呼叫端回滾整個更新，避免 -1 / +1 只套用一半。
+    """
+    if not _tables_ready(cursor) or _get_watermark(cursor, REPORT_WATERMARK) is None:
+        return  # 彙總表尚未建立或尚未初始化，refresh() 會一次計算全部
+    rows = []
+    if old_state and old_state[0] == REPORT_DONE_STATUS and old_state[2] is not None:
+        rows.append((old_state[1] or "", -1, -old_state[2]))
+    if new_state and new_state[0] == REPORT_DONE_STATUS and new_state[2] is not None:
+        rows.append((new_state[1] or "", 1, new_state[2]))
+    for row in rows:
+        cursor.execute(MERGE_TURNAROUND_SQL, *row)
+
+
+def refresh_reports(conn):
+    """第一次執行時由 CC_REPORT 計算全部的處理時間，之後由寫入時的 hook 遞增維護。"""
+    cursor = conn.cursor()
+    try:
+        if _get_watermark(cursor, REPORT_WATERMARK) is not None:
+            conn.rollback()
+            return False
+        cursor.execute("DELETE FROM CC_REPORT_TURNAROUND")
+        cursor.execute("""
+            INSERT INTO CC_REPORT_TURNAROUND (ISSUE_TYPE, COMPLETED, TOTAL_SECONDS)
+            SELECT ISNULL(ISSUE_TYPE, ''), COUNT(*), SUM(DATEDIFF_BIG(SECOND, REPORT_TIME, PROCESS_TIME))
+            FROM CC_REPORT
+            WHERE STATUS = ? AND REPORT_TIME IS NOT NULL AND PROCESS_TIME IS NOT NULL
+            GROUP BY ISNULL(ISSUE_TYPE, '')
+        """, REPORT_DONE_STATUS)
+        cursor.execute("SELECT ISNULL(MAX(ID), 0) FROM CC_REPORT")
+        _set_watermark(cursor, REPORT_WATERMARK, cursor.fetchone()[0])
+        conn.commit()
+        return True
+    except Exception:
+        conn.rollback()
+        raise
+
+
+def refresh(conn):
+    """更新全部彙總；其他 worker 正在執行時直接略過，回傳 None。"""
+    with _refresh_lock(conn) as acquired:
+        if not acquired:
+            logging.info("另一個 worker 正在更新統計彙總，略過")
+            return None
+        initialized = refresh_reports(conn)
+        processed = refresh_status(conn)
+    return {"logs": processed, "reports_initialized": initialized}
+
+
+def rebuild(conn):
+    """清空全部彙總表後重新計算 (只會包含仍在 CC_LOG 中、尚未歸檔的日誌)。"""
+    with _refresh_lock(conn) as acquired:
+        if not acquired:
+            return None
+        cursor = conn.cursor()
+        for table in ROLLUP_TABLES:
+            cursor.execute(f"DELETE FROM {table}")
+        conn.commit()
+        # applock 可在同一個 session 重複取得
+        return refresh(conn)
+
+
+def start_worker(connect, interval):
+    """以背景執行緒每 interval 秒執行一次 refresh()；connect 為建立新連線的函式。"""
+    def run():
+        while True:
+            try:
+                conn = connect()
+                try:
+                    refresh(conn)
+                finally:
+                    conn.close()
+            except Exception as e:
+                logging.error(f"統計彙總背景更新失敗: {e}")
+            time.sleep(interval)
+
+    thread = threading.Thread(target=run, name="rollup-refresh", daemon=True)
+    thread.start()
+    return thread
+
+
+# ===============================================
+# 查詢
+# ===============================================
+def status_daily(cursor, start, end):
+    """
+    回傳 start ~ end 每天結束時各狀態的器材數，以及當天進入/離開的次數。
+    沒有資料的日期沿用前一天的數量。
+    """
+    cursor.execute("""
+        SELECT STAT_DATE, CC_STATUS, ITEM_COUNT, ENTERED, EXITED
+        FROM CC_STATUS_DAILY
+        WHERE STAT_DATE BETWEEN (
+            SELECT ISNULL(MAX(STAT_DATE), ?) FROM CC_STATUS_DAILY WHERE STAT_DATE <= ?
+        ) AND ?
+        ORDER BY STAT_DATE
+    """, start, start, end)
+    by_day = defaultdict(dict)
+    for stat_date, status, count, entered, exited in cursor.fetchall():
+        by_day[stat_date][status] = (count, entered, exited)
+
+    result = []
+    counts = {}
+    day = start
+    carried = sorted(d for d in by_day if d < start)
+    if carried:
+        counts = {s: v[0] for s, v in by_day[carried[-1]].items()}
+    while day <= end:
+        rows = by_day.get(day, {})
+        counts = {**counts, **{s: v[0] for s, v in rows.items()}}
+        result.append({
+            "date": day.isoformat(),
+            "counts": {s: c for s, c in counts.items() if c},
+            "entered": {s: v[1] for s, v in rows.items() if v[1]},
+            "exited": {s: v[2] for s, v in rows.items() if v[2]},
+        })
+        day = date.fromordinal(day.toordinal() + 1)
+    return result
+
+
+def status_durations(cursor):
+    """各狀態已結束區間的累計時間，加上目前仍在該狀態的器材已經過的時間。"""
+    cursor.execute("SELECT CC_STATUS, TOTAL_SECONDS, INTERVALS FROM CC_STATUS_DURATION")
+    result = defaultdict(lambda: {"closed_seconds": 0, "intervals": 0, "open_seconds": 0, "open_items": 0})
+    for status, seconds, intervals in cursor.fetchall():
+        result[status]["closed_seconds"] = seconds
+        result[status]["intervals"] = intervals
+    cursor.execute("""
+        SELECT CC_STATUS, SUM(DATEDIFF_BIG(SECOND, SINCE, GETDATE())), COUNT(*)
+        FROM CC_STATUS_CURRENT GROUP BY CC_STATUS
+    """)
+    for status, seconds, items in cursor.fetchall():
+        result[status]["open_seconds"] = seconds or 0
+        result[status]["open_items"] = items
+    for item in result.values():
+        item["avg_closed_seconds"] = item["closed_seconds"] / item["intervals"] if item["intervals"] else None
+    return dict(result)
+
+
+def report_turnaround(cursor):
+    cursor.execute("SELECT ISSUE_TYPE, COMPLETED, TOTAL_SECONDS FROM CC_REPORT_TURNAROUND ORDER BY ISSUE_TYPE")
+    return {
+        issue_type: {
+            "completed": completed,
+            "total_seconds": total,
+            "avg_seconds": total / completed if completed else None,
+        }
+        for issue_type, completed, total in cursor.fetchall()
+        if completed
+    }
+
+
+def watermarks(cursor):
+    cursor.execute("SELECT NAME, LAST_ID, UPDATED_AT FROM CC_ROLLUP_WATERMARK")
+    return {name: {"last_id": last_id, "updated_at": updated_at} for name, last_id, updated_at in cursor.fetchall()}
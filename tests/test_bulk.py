@@ -0,0 +1,75 @@
+# tests/test_bulk.py
+# 批次匯入：透過 Werkzeug 上傳檔案 (FileStorage，SpooledTemporaryFile) 讀取 CSV。
+
+import io
+import os
+import sys
+import tempfile
+
+from werkzeug.datastructures import FileStorage
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bulk  # noqa: E402
+
+
+class FakeCursor:
+    def __init__(self, conn):
+        self.conn = conn
+        self.fast_executemany = False
+
+    def executemany(self, sql, rows):
+        self.conn.executed.append((sql, list(rows)))
+
+
+class FakeConnection:
+    def __init__(self):
+        self.executed = []
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+
+def _upload(content, filename="equipment.csv"):
+    # 與 Werkzeug 預設的 stream factory 相同，上傳內容放在 SpooledTemporaryFile
+    stream = tempfile.SpooledTemporaryFile(max_size=500 * 1024, mode="wb+")
+    stream.write(content)
+    stream.seek(0)
+    return FileStorage(stream=stream, filename=filename, content_type="text/csv")
+
+
+def test_import_csv_from_file_storage():
+    content = (
+        "\ufeffCCM_ID,CC_SIZE,BOX_ID,USER_NAME,CC_STARTTIME,CC_STATUS,COMMENT\r\n"
+        "EQ001,L,BOX1,王小明,2024-01-02 08:00:00,使用中,\"多行\r\n備註\"\r\n"
+        "EQ002,M,BOX1,,,,\r\n"
+        ",S,BOX2,,,,\r\n"
+    ).encode("utf-8")
+    conn = FakeConnection()
+
+    result = bulk.import_equipment(conn, _upload(content).stream, "equipment.csv", "tester")
+
+    assert result["total"] == 3
+    assert result["imported"] == 2
+    assert [e["row"] for e in result["errors"]] == [4]
+    master_rows = conn.executed[0][1]
+    assert [row[0] for row in master_rows] == ["EQ001", "EQ002"]
+    assert master_rows[0][3] == "王小明"
+    log_rows = conn.executed[1][1]
+    assert log_rows[0][5] == "多行\r\n備註"
+
+
+def test_import_rejects_unknown_extension():
+    try:
+        bulk.import_equipment(FakeConnection(), io.BytesIO(b"CCM_ID\n"), "equipment.txt", "tester")
+    except bulk.ImportFormatError:
+        pass
+    else:
+        raise AssertionError("expected ImportFormatError")
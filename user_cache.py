@@ -0,0 +1,193 @@
+# user_cache.py
+# 使用者是否存在的行程內快取，讓登入畫面的帳號檢查大多不需要查詢資料庫。
+#
+# - Bloom filter 收錄 CC_USER 全部帳號：判定「不在」時一定不存在，直接回答
+# - 判定「可能在」時先查已確認的 LRU 快取，都沒有才查資料庫並記下結果
+# - 每 ttl 秒以 CREATED_AT 遞增載入新帳號；總數對不上 (有刪除或漏掉) 時整批重建
+#
+# 多個 worker 時：本 worker 的註冊立即生效；其他 worker 新增的帳號最晚 ttl 秒後可見。
+# 「存在」的回答一定來自資料庫或本 worker 的寫入，不會誤判存在。
+# 「不存在」可能是 ttl 內尚未同步的結果，答錯會造成問題的路徑 (註冊、重設密碼)
+# 以 confirm_absent=True 再向資料庫確認一次。
+
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_TTL = 5
+DEFAULT_LRU_SIZE = 10000
+FALSE_POSITIVE_RATE = 0.01
+MIN_CAPACITY = 1024
+
+
+def normalize(username):
+    # SQL Server 預設定序不分大小寫且忽略尾端空白
+    return username.rstrip().upper()
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=FALSE_POSITIVE_RATE):
+        self.capacity = max(capacity, MIN_CAPACITY)
+        self.size = math.ceil(-self.capacity * math.log(error_rate) / (math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / self.capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+
+class _LRU:
+    def __init__(self, size):
+        self.size = size
+        self._items = OrderedDict()
+
+    def get(self, key):
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key, value):
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.size:
+            self._items.popitem(last=False)
+
+    def discard(self, key):
+        self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
+
+
+class UserDirectory:
+    def __init__(self, ttl=DEFAULT_TTL, lru_size=DEFAULT_LRU_SIZE):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._bloom = None
+        self._confirmed = _LRU(lru_size)  # normalize(名稱) -> True / False (已向資料庫確認)
+        self._count = 0
+        self._watermark = None
+        self._incremental = True
+        self._refreshed_at = None
+
+    # ===============================================
+    # 載入
+    # ===============================================
+    def _full_reload(self, cursor):
+        # 尚未套用 CREATED_AT 欄位 (migration v4) 的資料庫：每次都整批載入
+        cursor.execute("SELECT COL_LENGTH('dbo.CC_USER', 'CREATED_AT')")
+        self._incremental = cursor.fetchone()[0] is not None
+        created_at = "CREATED_AT" if self._incremental else "NULL"
+        cursor.execute(f"SELECT USER_NAME, {created_at} FROM CC_USER")
+        rows = cursor.fetchall()
+
+        bloom = BloomFilter(len(rows) * 2)
+        watermark = None
+        for name, created_at in rows:
+            bloom.add(normalize(name))
+            if created_at is not None and (watermark is None or created_at > watermark):
+                watermark = created_at
+        with self._lock:
+            self._bloom = bloom
+            self._confirmed.clear()
+            self._count = len(rows)
+            self._watermark = watermark
+        logging.debug(f"已載入 {len(rows)} 個使用者到帳號快取")
+
+    def _incremental_reload(self, cursor):
+        """載入 watermark 之後新增的帳號；總數對不上時回傳 False 表示需要整批重建。"""
+        if self._watermark is None:
+            cursor.execute("SELECT USER_NAME, CREATED_AT FROM CC_USER WHERE CREATED_AT IS NOT NULL")
+        else:
+            cursor.execute("SELECT USER_NAME, CREATED_AT FROM CC_USER WHERE CREATED_AT > ?", self._watermark)
+        rows = cursor.fetchall()
+        cursor.execute("SELECT COUNT(*) FROM CC_USER")
+        total = cursor.fetchone()[0]
+        if self._count + len(rows) != total or total > self._bloom.capacity:
+            return False
+        with self._lock:
+            for name, created_at in rows:
+                key = normalize(name)
+                self._bloom.add(key)
+                self._confirmed.discard(key)
+                if self._watermark is None or created_at > self._watermark:
+                    self._watermark = created_at
+            self._count = total
+        return True
+
+    def is_stale(self):
+        return self._refreshed_at is None or time.monotonic() - self._refreshed_at >= self.ttl
+
+    def refresh(self, conn, force=False):
+        if not force and not self.is_stale():
+            return
+        # 已有資料時，其他執行緒正在更新就沿用目前的內容，不重複查詢
+        if not self._refresh_lock.acquire(blocking=self._bloom is None or force):
+            return
+        try:
+            if force or self.is_stale():
+                cursor = conn.cursor()
+                if self._bloom is None or not self._incremental or not self._incremental_reload(cursor):
+                    self._full_reload(cursor)
+                self._refreshed_at = time.monotonic()
+        finally:
+            self._refresh_lock.release()
+
+    # ===============================================
+    # 查詢與更新
+    # ===============================================
+    def exists(self, conn, username, confirm_absent=False):
+        """
+        回傳帳號是否存在；Bloom filter 判定不存在時不查詢資料庫。
+        confirm_absent=True 時快取判定不存在 (可能是其他 worker 剛註冊、尚未同步) 也會查詢資料庫確認。
+        """
+        self.refresh(conn)
+        key = normalize(username)
+        with self._lock:
+            if key not in self._bloom:
+                confirmed = False
+            else:
+                confirmed = self._confirmed.get(key)
+        if confirmed is True or (confirmed is False and not confirm_absent):
+            return confirmed
+
+        cursor = conn.cursor()
+        cursor.execute("SELECT COUNT(*) FROM CC_USER WHERE USER_NAME = ?", (username,))
+        found = cursor.fetchone()[0] > 0
+        if found:
+            self.mark_exists(username)
+        else:
+            with self._lock:
+                if key in self._bloom:
+                    self._confirmed.put(key, False)
+        return found
+
+    def mark_exists(self, username):
+        """註冊或重設密碼成功後呼叫，讓本 worker 立即看到這個帳號。"""
+        key = normalize(username)
+        with self._lock:
+            if self._bloom is not None:
+                self._bloom.add(key)
+            self._confirmed.put(key, True)
+
+    def invalidate(self, username):
+        """結果不確定時 (例如寫入失敗) 移除已確認的紀錄，下次改查資料庫。"""
+        with self._lock:
+            self._confirmed.discard(normalize(username))